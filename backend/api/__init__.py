@@ -1,2 +1,4 @@
 from backend.api.user import *
 from backend.api.mainapp import *
+from backend.api.admin import *
+from backend.api.metrics import *
@@ -0,0 +1,47 @@
+from typing import Optional
+from fastapi import Query
+from fastapi_utils.cbv import cbv
+from fastapi_utils.inferring_router import InferringRouter
+
+from backend.app import app
+from backend.api.base import BaseAppAuth
+from backend.api.user import admin_role_authentificated
+from backend.db.base import get_pool_stats
+from backend.db.query_stats import query_stats
+from backend.library.security import hash_pool
+from backend.library.metrics import get_stats
+
+
+router = InferringRouter()
+
+
+@cbv(router)
+class AdminApp(BaseAppAuth):
+    @router.get("/api/admin/stats", tags=["admin"])
+    @admin_role_authentificated
+    async def get_stats(self):
+        return {
+            'success': True,
+            'db_pool': get_pool_stats(),
+            'password_hash': hash_pool.stats(),
+            **get_stats(),
+        }
+
+    @router.get("/api/admin/queries", tags=["admin"])
+    @admin_role_authentificated
+    async def get_queries(
+        self,
+        order_by: str = Query('total', regex='^(total|p95|mean|max|count|slow)$'),
+        limit: Optional[int] = Query(50, ge=1),
+    ):
+        """SQL statements grouped by fingerprint with time in seconds and plans of slow ones"""
+        return {'success': True, 'queries': query_stats.stats(order_by, limit)}
+
+    @router.delete("/api/admin/queries", tags=["admin"])
+    @admin_role_authentificated
+    async def clear_queries(self):
+        query_stats.clear()
+        return {'success': True}
+
+
+app.include_router(router)
@@ -1,11 +1,18 @@
-from fastapi import Depends
+from typing import Optional, List
+import orjson
+from fastapi import Depends, Request
+from fastapi.responses import StreamingResponse, ORJSONResponse
 
 from backend.models.user import UserInDB
 from backend.library.security import get_current_active_user
 from backend.db.base import execute
+from backend.library.metrics import timer
+from backend.config import PAGE_LIMIT, STREAM_CHUNK_SIZE
 
 
 class BaseApp:
+    request: Request
+
     @classmethod
     async def prepare(cls, obj_db):
         return {"success": obj_db is not None}
@@ -16,11 +23,43 @@ class BaseApp:
         return query_res[0] if len(query_res) > 0 else None
 
     @staticmethod
-    async def get_list(cls, name='items'):
-        objs = []
-        for obj in await execute(cls.select().order_by(cls.id)):
-            objs.append(await obj.dict)
-        return {name: objs}
+    def get_page_query(cls, limit: int, after_id: Optional[int] = None):
+        query = cls.select(*cls.get_visible_columns()).order_by(cls.id).limit(limit)
+        if after_id is not None:
+            query = query.where(cls.id > after_id)
+        return query.tuples()
+
+    @staticmethod
+    async def get_page(cls, limit: int, after_id: Optional[int] = None) -> List[dict]:
+        rows = await execute(BaseApp.get_page_query(cls, limit, after_id))
+        with timer('serialization'):
+            return cls.get_serializer()(rows)
+
+    @staticmethod
+    async def get_list(cls, name='items', limit: int = PAGE_LIMIT, after_id: Optional[int] = None):
+        objs = await BaseApp.get_page(cls, limit, after_id)
+        next_after_id = objs[-1]['id'] if len(objs) == limit else None
+        with timer('serialization'):
+            return ORJSONResponse({name: objs, 'next_after_id': next_after_id})
+
+    @staticmethod
+    async def gen_list(cls, after_id: Optional[int] = None, chunk_size: int = STREAM_CHUNK_SIZE):
+        """Yields list of objects chunk by chunk, so the whole table is never loaded at once"""
+        while True:
+            objs = await BaseApp.get_page(cls, chunk_size, after_id)
+            if objs:
+                yield objs
+            if len(objs) < chunk_size:
+                break
+            after_id = objs[-1]['id']
+
+    @staticmethod
+    def stream_list(cls, after_id: Optional[int] = None, chunk_size: int = STREAM_CHUNK_SIZE):
+        async def gen_lines():
+            async for objs in BaseApp.gen_list(cls, after_id, chunk_size):
+                yield b''.join(orjson.dumps(obj) + b'\n' for obj in objs)
+
+        return StreamingResponse(gen_lines(), media_type='application/x-ndjson')
 
 
 class BaseAppAuth(BaseApp):
@@ -0,0 +1,144 @@
+import functools
+import hashlib
+from typing import Callable, Optional
+import orjson
+from fastapi import Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from backend.config import RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_N, RESPONSE_CACHE_REDIS
+from backend.library.cache import TemporaryDict
+from backend.library.coro import start_coro
+from backend.library.func import MultiFuncBase
+from backend.library.metrics import register_stats, timed
+
+
+def get_role_scope(handler) -> str:
+    return handler.current_user.role
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Checks If-None-Match header against etag, weak comparison is used as GET requests allow it"""
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag:
+            return True
+    return False
+
+
+@timed('serialization')
+def render_json(content) -> bytes:
+    return orjson.dumps(jsonable_encoder(content))
+
+
+class ResponseCache:
+    """
+    Cache of JSON responses of GET endpoints of cbv classes. Responses are keyed by path, query and scope (role of
+    the user by default), kept in TemporaryDict and optionally in Redis, and returned with ETag, so that clients
+    with actual response get 304
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_n: int = RESPONSE_CACHE_MAX_N,
+        redis: bool = RESPONSE_CACHE_REDIS,
+        notifier: MultiFuncBase = None,
+    ):
+        """
+        :param name: name of the cache, prefix of Redis keys
+        :param notifier: MultiFunc that is called with ids of changed objects
+        """
+        self.name = name
+        self.ttl = ttl
+        self.redis = redis
+        self.data = TemporaryDict(ttl=ttl, max_n=max_n)  # key: (etag, body, obj_id)
+        self.generation = 0  # responses made before the last invalidation are not cached
+        if notifier:
+            notifier.add(self.invalidate)
+        register_stats(f'response_cache_{name}', self.data.stats)
+
+    @staticmethod
+    def get_key(request: Request, scope) -> tuple:
+        return request.url.path, tuple(sorted(request.query_params.multi_items())), scope
+
+    def get_redis_key(self, key: tuple, obj_id=None) -> str:
+        digest = hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+        return f'response:{self.name}:{"list" if obj_id is None else obj_id}:{digest}'
+
+    async def get(self, key: tuple, obj_id=None) -> Optional[tuple]:
+        answer = self.data.get(key)
+        if answer is None and self.redis:
+            from backend.library.redis import get_json
+
+            value = await get_json(self.get_redis_key(key, obj_id))
+            if value is not None:
+                answer = self.data[key] = (value['etag'], value['body'].encode(), obj_id)
+        return answer
+
+    async def set(self, key: tuple, body: bytes, obj_id=None) -> tuple:
+        answer = self.data[key] = (hashlib.blake2b(body, digest_size=16).hexdigest(), body, obj_id)
+        if self.redis:
+            from backend.library.redis import set_json
+
+            await set_json(self.get_redis_key(key, obj_id), {'etag': answer[0], 'body': body.decode()}, self.ttl)
+        return answer
+
+    def invalidate(self, *ids):
+        """
+        Deletes responses for objects with ids and all responses that are not bound to an object, like lists. Without
+        ids changed objects are unknown, so all responses are deleted
+        """
+        ids = set(ids)
+        self.generation += 1
+        if ids:
+            for key, (_, _, obj_id) in self.data.items():
+                if obj_id is None or obj_id in ids:
+                    del self.data[key]
+        else:
+            self.data.clear()
+        if self.redis:
+            from backend.library.redis import delete_pattern
+
+            for obj_id in ['list', *ids] if ids else ['*']:
+                start_coro(delete_pattern(f'response:{self.name}:{obj_id}:*'))
+
+    def cached(self, scope: Callable = get_role_scope, id_arg: Optional[str] = None):
+        """
+        Returns decorator for methods of cbv classes with request attribute. Only dicts, lists and successful JSON
+        responses are cached, others like streaming responses are returned as is
+        :param scope: function of handler that returns part of the key, responses are shared inside the scope
+        :param id_arg: name of the argument with id of the object, responses are invalidated by it
+        """
+        cache = self
+
+        def decorator(method):
+            @functools.wraps(method)
+            async def wrapper(self, *args, **kwargs):
+                request: Request = self.request
+                key = cache.get_key(request, scope(self))
+                obj_id = kwargs.get(id_arg) if id_arg else None
+                answer = await cache.get(key, obj_id)
+                if answer is None:
+                    generation = cache.generation
+                    result = await method(self, *args, **kwargs)
+                    if isinstance(result, (dict, list)):
+                        body = render_json(result)
+                    elif isinstance(result, JSONResponse) and result.status_code == status.HTTP_200_OK:
+                        body = result.body
+                    else:
+                        return result
+                    if generation != cache.generation:
+                        return Response(body, media_type='application/json')
+                    answer = await cache.set(key, body, obj_id)
+                etag = f'"{answer[0]}"'
+                if etag_matches(etag, request.headers.get('if-none-match', '')):
+                    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+                return Response(answer[1], media_type='application/json', headers={'ETag': etag})
+
+            return wrapper
+
+        return decorator
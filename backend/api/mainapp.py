@@ -1,38 +1,67 @@
 from fastapi_utils.cbv import cbv
 from fastapi_utils.inferring_router import InferringRouter
-from fastapi import Depends, Response
+from typing import Optional
+from fastapi import Depends, Response, Query, Request, HTTPException, status
 
 from backend.app import app
-from backend.models.item import Item, ItemInDB
+from backend.models.item import Item, ItemInDB, reset_item_cache
 from backend.api.base import BaseAppAuth
+from backend.api.cache import ResponseCache
 from backend.api.user import set_response_headers
+from backend.api.utils import read_json_list, iter_request_body
+from backend.library.csv_stream import iter_csv_rows
+from backend.config import PAGE_LIMIT, MAX_PAGE_LIMIT
 
 
 router = InferringRouter()
+items_cache = ResponseCache('items', notifier=reset_item_cache)
 
 
 @cbv(router)
 class MainApp(BaseAppAuth):
     @classmethod
     async def get_object_id(cls, item_id):
-        return await cls.get_one_object(ItemInDB.select().where(ItemInDB.id == item_id))
+        return await cls.get_one_object(ItemInDB.select(*ItemInDB.get_visible_fields()).where(ItemInDB.id == item_id))
 
     @router.get("/api/items/list", tags=["MainApp"])
-    async def get_items(self):
-        return await self.get_list(ItemInDB)
+    @items_cache.cached()
+    async def get_items(
+        self,
+        limit: int = Query(PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+        after_id: Optional[int] = None,
+        stream: bool = False,
+    ):
+        if stream:
+            return self.stream_list(ItemInDB, after_id=after_id)
+        return await self.get_list(ItemInDB, limit=limit, after_id=after_id)
 
     @router.get("/api/items/{item_id}", tags=["MainApp"])
+    @items_cache.cached(id_arg='item_id')
     async def get_item(self, item_id: int):
         item_db = await self.get_object_id(item_id)
         res = await self.prepare(item_db)
         if item_db is not None:
-            res.update(await item_db.dict)
+            res.update(item_db.to_dict())
         return res
 
     @router.post("/api/items/new", tags=["MainApp"])
     async def new_item(self, item: Item = Depends()):
         return await ItemInDB.update_or_create(item, ret={"success": True})
 
+    @router.post("/api/items/bulk", tags=["MainApp"])
+    async def bulk_items(self, request: Request):
+        """Creates items and updates items with id. Body is JSON array or NDJSON (application/x-ndjson)"""
+        items = await read_json_list(request)
+        return await ItemInDB.bulk_update_or_create(items, Item, ret={"success": True})
+
+    @router.post("/api/items/upload", tags=["MainApp"])
+    async def upload_items(self, request: Request):
+        """Creates items from CSV with header. Body is CSV (text/csv) or file in multipart/form-data"""
+        try:
+            return await ItemInDB.load_csv(iter_csv_rows(iter_request_body(request)), ret={"success": True})
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
     @router.put("/api/items/{item_id}", tags=["MainApp"])
     async def update_item(self, item_id: int, item: Item = Depends()):
         item_db = await self.get_object_id(item_id)
@@ -60,6 +89,16 @@ async def options_new_item(response: Response):
     return await set_response_headers(response)
 
 
+@app.options("/api/items/bulk", tags=["MainApp"])
+async def options_bulk_items(response: Response):
+    return await set_response_headers(response)
+
+
+@app.options("/api/items/upload", tags=["MainApp"])
+async def options_upload_items(response: Response):
+    return await set_response_headers(response)
+
+
 @app.options("/api/items/{item_id}", tags=["MainApp"])
 async def options_update_item(response: Response):
     return await set_response_headers(response)
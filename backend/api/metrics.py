@@ -0,0 +1,122 @@
+import cProfile
+import re
+from os import makedirs
+from os.path import join, basename
+from time import perf_counter, time
+from fastapi.responses import PlainTextResponse
+
+from backend.app import app
+from backend.config import (
+    METRICS_ENABLED,
+    METRICS_PATH,
+    METRICS_PROFILE,
+    METRICS_PROFILE_HEADER,
+    METRICS_PROFILER,
+    METRICS_PROFILE_DIR,
+)
+from backend.library.metrics import RequestMetrics, request_metrics, start_timings, stop_timings
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+
+class RequestProfiler:
+    """Profiles one request by pyinstrument (HTML report) or cProfile (.prof file for pstats)"""
+
+    def __init__(self, path: str, use_pyinstrument: bool):
+        self.use_pyinstrument = use_pyinstrument
+        self.path = f'{path}.html' if use_pyinstrument else f'{path}.prof'
+        self._profiler = Profiler(async_mode='enabled') if use_pyinstrument else cProfile.Profile()
+
+    def start(self):
+        if self.use_pyinstrument:
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+        if self.use_pyinstrument:
+            self._profiler.stop()
+            with open(self.path, 'w') as f:
+                f.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.path)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware that observes time of each request by route template and time of its components (db, redis,
+    password_hash, serialization) collected by timed functions. Requests with profile header are profiled if it's
+    allowed by config
+    """
+
+    def __init__(
+        self,
+        app,
+        metrics: RequestMetrics = request_metrics,
+        profile: bool = METRICS_PROFILE,
+        profile_header: str = METRICS_PROFILE_HEADER,
+        profiler: str = METRICS_PROFILER,
+    ):
+        self.app = app
+        self.metrics = metrics
+        self.profile = profile
+        self.profile_header = profile_header.lower().encode()
+        self.use_pyinstrument = profiler == 'pyinstrument' or (profiler == 'auto' and Profiler is not None)
+        self._routes = {}  # endpoint: path template
+
+    def get_route(self, scope) -> str:
+        endpoint = scope.get('endpoint')
+        if endpoint is None:
+            return 'unmatched'
+        route = self._routes.get(endpoint)
+        if route is None:
+            self._routes = {getattr(r, 'endpoint', None): r.path for r in scope['app'].routes if hasattr(r, 'path')}
+            route = self._routes.get(endpoint, 'unmatched')
+        return route
+
+    def get_profiler(self, scope):
+        if not self.profile or not any(key == self.profile_header and value for key, value in scope['headers']):
+            return None
+        name = re.sub(r'[^\w.-]+', '_', f'{scope["method"]}{scope["path"]}')
+        return RequestProfiler(join(METRICS_PROFILE_DIR, f'{int(time() * 1000)}_{name}'), self.use_pyinstrument)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        status_code = 500
+        profiler = self.get_profiler(scope)
+
+        async def send_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if profiler is not None:
+                    header = (b'x-profile-file', basename(profiler.path).encode())
+                    message['headers'] = [*message.get('headers', []), header]
+            await send(message)
+
+        timings, token = start_timings()
+        if profiler is not None:
+            profiler.start()
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            seconds = perf_counter() - started
+            if profiler is not None:
+                profiler.stop()
+            stop_timings(token)
+            self.metrics.observe(scope['method'], self.get_route(scope), status_code, seconds, timings)
+
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+    @app.get(METRICS_PATH, include_in_schema=False)
+    async def get_metrics():
+        return PlainTextResponse(request_metrics.render(), media_type='text/plain; version=0.0.4')
@@ -6,10 +6,16 @@ from fastapi_utils.inferring_router import InferringRouter
 
 from backend.app import app
 from backend.models.user import Token, User, UserInDB
-from backend.library.security import authenticate_user, create_access_token, get_password_hash
+from backend.library.security import (
+    authenticate_user,
+    create_access_token,
+    get_password_hash,
+    get_password_hash_async,
+)
 from backend.library.auth import role_authenticated
 from backend.config import ACCESS_TOKEN_EXPIRE_MINUTES
 from backend.api.base import BaseApp, BaseAppAuth
+from backend.db.base import init_db
 
 
 all_role_authentificated = role_authenticated('admin', 'user', 'restricted_user')
@@ -27,7 +33,7 @@ async def set_response_headers(response: Response):
 
 @app.post("/login", response_model=Token, tags=["user"])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    auth_user = authenticate_user(form_data.username, form_data.password)
+    auth_user = await authenticate_user(form_data.username, form_data.password)
     if not auth_user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -41,7 +47,7 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 
 @app.get("/hash")
 async def get_hash(password: str):
-    return {"success": True, 'hash': get_password_hash(password)}
+    return {"success": True, 'hash': await get_password_hash_async(password)}
 
 
 @app.get("/")
@@ -67,14 +73,14 @@ class UserApp(BaseAppAuth):
 
     @router.get("/api/user", tags=["user"])
     async def read_current_user(self):
-        user_dict = await self.current_user.dict
-        return user_dict
+        return self.current_user.to_dict()
 
 
 app.include_router(router)
 
 
 if __name__ == "__main__":
+    init_db()
     user = UserInDB(
         username='test',
         email='test@mail.ru',
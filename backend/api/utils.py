@@ -1,35 +1,86 @@
-from typing import Dict, Optional, Any
+from typing import Dict, Optional, Any, List, AsyncIterator
 from os.path import join
 import uuid
-from fastapi import UploadFile
+import json
+from fastapi import UploadFile, Request, HTTPException, status
+from starlette.datastructures import UploadFile as StarletteUploadFile
 
-from backend.config import DATA_DIR
+from backend.config import DATA_DIR, UPLOAD_CHUNK_SIZE
+from backend.library.coro import coro_func
+from backend.library.func import new_file
 
 
-def upload_file(
-    file: UploadFile, ret: Optional[Dict[str, Any]] = None, chunk_size: int = 10240
+def write_file(filename: str, body: bytes, mode: str = 'wb'):
+    with open(filename, mode) as f:
+        f.write(body)
+
+
+async def iter_upload(file: UploadFile, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    while contents := await file.read(chunk_size):
+        yield contents
+
+
+async def iter_request_body(request: Request, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yields chunks of uploaded file for multipart/form-data requests and chunks of body for others"""
+    if request.headers.get('content-type', '').startswith('multipart/form-data'):
+        form = await request.form()
+        files = [val for val in form.values() if isinstance(val, StarletteUploadFile)]
+        if not files:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='File is expected')
+        try:
+            async for contents in iter_upload(files[0], chunk_size):
+                yield contents
+        finally:
+            await form.close()
+    else:
+        async for contents in request.stream():
+            yield contents
+
+
+async def upload_file(
+    file: UploadFile, ret: Optional[Dict[str, Any]] = None, chunk_size: int = UPLOAD_CHUNK_SIZE
 ) -> (Dict[str, Any], Optional[str]):
     if ret is None:
         ret = {}
     filename = join(DATA_DIR, str(uuid.uuid4()) + ".csv")
     try:
-        with open(filename, 'wb') as f:
-            while contents := file.file.read(chunk_size):
-                f.write(contents)
+        await coro_func(new_file, filename)
+        async for contents in iter_upload(file, chunk_size):
+            await coro_func(write_file, filename, contents, 'ab')
     except Exception:
         return {"success": False, "message": "There was an error uploading the file"}, None
     finally:
-        file.file.close()
+        await file.close()
     return ret, filename
 
 
-def upload_body(body: bytes, ret: Optional[Dict[str, Any]] = None) -> (Dict[str, Any], Optional[str]):
+async def upload_body(body: bytes, ret: Optional[Dict[str, Any]] = None) -> (Dict[str, Any], Optional[str]):
     if ret is None:
         ret = {}
     filename = join(DATA_DIR, str(uuid.uuid4()) + ".csv")
     try:
-        with open(filename, 'wb') as f:
-            f.write(body)
+        await coro_func(write_file, filename, body)
     except Exception:
         return {"success": False, "message": "There was an error uploading the file"}, None
     return ret, filename
+
+
+async def read_json_list(request: Request) -> List[Any]:
+    """Reads list of objects from request body: JSON array or NDJSON stream (one JSON object per line)"""
+    try:
+        if request.headers.get('content-type', '').startswith('application/x-ndjson'):
+            objs = []
+            tail = b''
+            async for chunk in request.stream():
+                lines = (tail + chunk).split(b'\n')
+                tail = lines.pop()
+                objs.extend(json.loads(line) for line in lines if line.strip())
+            if tail.strip():
+                objs.append(json.loads(tail))
+            return objs
+        objs = await request.json()
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Not valid JSON: {e}')
+    if not isinstance(objs, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='JSON array is expected')
+    return objs
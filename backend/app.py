@@ -1,3 +1,30 @@
 from fastapi import FastAPI
 
+from backend.db.base import init_db, close_db
+from backend.library.security import hash_pool
+from backend.library.coro import on_shutdown
+from backend.library.logger import MainLogger
+from backend.config import REDIS_INVALIDATION
+
+if REDIS_INVALIDATION:
+    from backend.library.invalidation import start_invalidation, stop_invalidation
+
 app = FastAPI()
+
+
+@app.on_event("startup")
+async def startup():
+    MainLogger.update_main_logger()
+    init_db()
+    if REDIS_INVALIDATION:
+        start_invalidation()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    if REDIS_INVALIDATION:
+        await stop_invalidation()
+    await on_shutdown()
+    await close_db()
+    hash_pool.shutdown()
+    MainLogger.stop_listeners()
@@ -27,6 +27,81 @@ DB_SETTINGS['PORT'] = DB_SETTINGS.get('PORT', 8000)
 DB_NAME = DB_SETTINGS.get('NAME', None)
 DB_USER = DB_SETTINGS.get('USER', 'postgres')
 DB_ASYNC = False if IS_TEST else DB_SETTINGS.get('ASYNC', False)
+DB_MIN_CONNECTIONS = DB_SETTINGS.get('MIN_CONNECTIONS', 1)
+DB_MAX_CONNECTIONS = DB_SETTINGS.get('MAX_CONNECTIONS', 8)
+DB_STALE_TIMEOUT = DB_SETTINGS.get('STALE_TIMEOUT', -1)
+DB_ACQUIRE_TIMEOUT = DB_SETTINGS.get('ACQUIRE_TIMEOUT', None)
+DB_CONNECTION_TIMEOUT = DB_SETTINGS.get('CONNECTION_TIMEOUT', 60)
+DB_STATEMENT_TIMEOUT = DB_SETTINGS.get('STATEMENT_TIMEOUT', 0)
+
+SERVER_SETTINGS = settings.get('SERVER', {})
+SERVER_WORKERS = SERVER_SETTINGS.get('WORKERS', 1)
+SERVER_LOOP = SERVER_SETTINGS.get('LOOP', 'auto')
+SERVER_HTTP = SERVER_SETTINGS.get('HTTP', 'auto')
+SERVER_BACKLOG = SERVER_SETTINGS.get('BACKLOG', 2048)
+SERVER_KEEP_ALIVE = SERVER_SETTINGS.get('KEEP_ALIVE', 5)
+SERVER_LIMIT_CONCURRENCY = SERVER_SETTINGS.get('LIMIT_CONCURRENCY', None)
+
+API_SETTINGS = settings.get('API', {})
+PAGE_LIMIT = API_SETTINGS.get('PAGE_LIMIT', 100)
+MAX_PAGE_LIMIT = API_SETTINGS.get('MAX_PAGE_LIMIT', 1000)
+STREAM_CHUNK_SIZE = API_SETTINGS.get('STREAM_CHUNK_SIZE', 1000)
+BULK_BATCH_SIZE = API_SETTINGS.get('BULK_BATCH_SIZE', 1000)
+COPY_BATCH_SIZE = API_SETTINGS.get('COPY_BATCH_SIZE', 10000)
+UPLOAD_CHUNK_SIZE = API_SETTINGS.get('UPLOAD_CHUNK_SIZE', 1048576)
+
+HASH_SETTINGS = settings.get('PASSWORD_HASH', {})
+HASH_EXECUTOR = HASH_SETTINGS.get('EXECUTOR', 'process')
+HASH_WORKERS = HASH_SETTINGS.get('WORKERS', 2)
+HASH_MAX_CONCURRENT = HASH_SETTINGS.get('MAX_CONCURRENT', HASH_WORKERS)
+
+USER_CACHE_SETTINGS = settings.get('USER_CACHE', {})
+USER_CACHE_TTL = USER_CACHE_SETTINGS.get('TTL', 60)
+USER_CACHE_MAX_N = USER_CACHE_SETTINGS.get('MAX_N', 10000)
+USER_CACHE_REDIS = USER_CACHE_SETTINGS.get('REDIS', False)
+
+TOKEN_CACHE_SETTINGS = settings.get('TOKEN_CACHE', {})
+TOKEN_CACHE_MAX_N = TOKEN_CACHE_SETTINGS.get('MAX_N', 10000)
+
+RESPONSE_CACHE_SETTINGS = settings.get('RESPONSE_CACHE', {})
+RESPONSE_CACHE_TTL = RESPONSE_CACHE_SETTINGS.get('TTL', 300)
+RESPONSE_CACHE_MAX_N = RESPONSE_CACHE_SETTINGS.get('MAX_N', 10000)
+RESPONSE_CACHE_REDIS = RESPONSE_CACHE_SETTINGS.get('REDIS', False)
+
+REDIS_SETTINGS = settings.get('REDIS', {})
+REDIS_URL = REDIS_SETTINGS.get('URL', 'redis://127.0.0.1:6379/0')
+REDIS_MAX_CONNECTIONS = REDIS_SETTINGS.get('MAX_CONNECTIONS', 50)
+REDIS_MAX_SUBSCRIPTIONS = REDIS_SETTINGS.get('MAX_SUBSCRIPTIONS', 10)
+REDIS_SOCKET_TIMEOUT = REDIS_SETTINGS.get('SOCKET_TIMEOUT', 5)
+REDIS_SOCKET_CONNECT_TIMEOUT = REDIS_SETTINGS.get('SOCKET_CONNECT_TIMEOUT', 2)
+REDIS_HEALTH_CHECK_INTERVAL = REDIS_SETTINGS.get('HEALTH_CHECK_INTERVAL', 30)
+REDIS_INVALIDATION = REDIS_SETTINGS.get('INVALIDATION', False)
+REDIS_INVALIDATION_CHANNEL = REDIS_SETTINGS.get('INVALIDATION_CHANNEL', 'cache_invalidation')
+REDIS_COUNTER_FLUSH_INTERVAL = REDIS_SETTINGS.get('COUNTER_FLUSH_INTERVAL', 0.5)
+REDIS_COUNTER_FLUSH_MAX = REDIS_SETTINGS.get('COUNTER_FLUSH_MAX', 1000)
+
+METRICS_SETTINGS = settings.get('METRICS', {})
+# metrics endpoint is not authenticated, so it's off unless it's enabled explicitly
+METRICS_ENABLED = True if IS_TEST else METRICS_SETTINGS.get('ENABLED', False)
+METRICS_PATH = METRICS_SETTINGS.get('PATH', '/metrics')
+METRICS_PROFILE = METRICS_SETTINGS.get('PROFILE', False)
+METRICS_PROFILE_HEADER = METRICS_SETTINGS.get('PROFILE_HEADER', 'X-Profile')
+METRICS_PROFILER = METRICS_SETTINGS.get('PROFILER', 'auto')
+METRICS_PROFILE_DIR = join(DATA_DIR, 'profiles')
+
+LOG_SETTINGS = settings.get('LOG', {})
+LOG_NAME = LOG_SETTINGS.get('NAME', 'backend')
+LOG_LEVEL = LOG_SETTINGS.get('LEVEL', 'INFO')
+LOG_MAX_BYTES = LOG_SETTINGS.get('MAX_BYTES', 10485760)
+LOG_BACKUP_COUNT = LOG_SETTINGS.get('BACKUP_COUNT', 5)
+LOG_JSON = LOG_SETTINGS.get('JSON', False)
+
+QUERY_STATS_SETTINGS = settings.get('QUERY_STATS', {})
+QUERY_STATS_ENABLED = QUERY_STATS_SETTINGS.get('ENABLED', False)
+QUERY_STATS_SLOW_MS = QUERY_STATS_SETTINGS.get('SLOW_MS', 100)
+QUERY_STATS_EXPLAIN = QUERY_STATS_SETTINGS.get('EXPLAIN', False)
+QUERY_STATS_EXPLAIN_INTERVAL = QUERY_STATS_SETTINGS.get('EXPLAIN_INTERVAL', 60)
+QUERY_STATS_MAX_N = QUERY_STATS_SETTINGS.get('MAX_N', 1000)
 
 for f in [DATA_DIR]:
     if not exists(f):
@@ -1,7 +1,16 @@
-from datetime import datetime
-from typing import Optional
+import csv
+import io
+import math
+import operator
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date
+from time import monotonic
+from typing import Optional, List, Any, AsyncIterable, Callable, Sequence
+import psycopg2
 from peewee_async import Manager
-from peewee_asyncext import PooledPostgresqlExtDatabase
+from pydantic import ValidationError
 from peewee import (
     ForeignKeyField,
     TextField,
@@ -14,32 +23,87 @@ from peewee import (
     AutoField,
     Proxy,
     Model,
+    ModelSelect,
+    DatabaseError,
+    CursorWrapper,
+    ValuesList,
+    Cast,
 )
 
-from backend.config import DB_NAME, DB_USER, DB_ASYNC
-from backend.library.func import FieldHidden
+from backend.config import (
+    DB_NAME,
+    DB_USER,
+    DB_ASYNC,
+    DB_MIN_CONNECTIONS,
+    DB_MAX_CONNECTIONS,
+    DB_STALE_TIMEOUT,
+    DB_ACQUIRE_TIMEOUT,
+    DB_CONNECTION_TIMEOUT,
+    DB_STATEMENT_TIMEOUT,
+    BULK_BATCH_SIZE,
+    COPY_BATCH_SIZE,
+)
+from backend.library.func import FieldHidden, MultiFuncBase
+from backend.library.coro import ExecutorPool
+from backend.library.metrics import register_stats, timed
 from backend.db.fields import OptionsField
+from backend.db.pool import PooledDatabase
 
 
 db = Proxy()
-db.initialize(
-    PooledPostgresqlExtDatabase(
-        DB_NAME,
-        user=DB_USER,
-        register_hstore=False,
-        max_connections=8,
-        autorollback=True,
-        connection_timeout=60,
-    )
-)
 manager: Manager = Proxy()
 manager.initialize(Manager(db))
+# threads of sync queries, each keeps its own connection, so there are not more of them than DB_MAX_CONNECTIONS
+sync_db_pool = ExecutorPool(ThreadPoolExecutor, max_workers=DB_MAX_CONNECTIONS)
+register_stats('sync_db_pool', sync_db_pool.stats)
+_sync_connections = []  # connections opened by threads of sync_db_pool, they are closed by close_db
+
+
+def init_db():
+    """Initializes database if it's not initialized yet. Should be called in each worker process after fork"""
+    if db.obj is None:
+        db.initialize(
+            PooledDatabase(
+                DB_NAME,
+                user=DB_USER,
+                register_hstore=False,
+                min_connections=DB_MIN_CONNECTIONS,
+                max_connections=DB_MAX_CONNECTIONS,
+                stale_timeout=DB_STALE_TIMEOUT,
+                acquire_timeout=DB_ACQUIRE_TIMEOUT,
+                autorollback=True,
+                connection_timeout=DB_CONNECTION_TIMEOUT,
+                **({'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'} if DB_STATEMENT_TIMEOUT else {}),
+            )
+        )
+    return db.obj
+
+
+async def close_db():
+    if db.obj is None:
+        return
+    if DB_ASYNC:
+        await manager.close()
+    sync_db_pool.shutdown()
+    while _sync_connections:
+        _sync_connections.pop().close()
+    if not db.is_closed():
+        db.close()
+
+
+def get_pool_stats() -> dict:
+    return db.obj.get_stats() if isinstance(db.obj, PooledDatabase) else {}
+
+
+_visible_fields = {}  # (model, hidden): fields
+_serializers = {}  # model: function that serializes rows
 
 
 class BaseDBModel(Model):
     id = AutoField(help_text='Unique id of an object', _hidden=FieldHidden.WRITE)
     swagger_ignore = True
     not_editable = ['id']
+    notifier: Optional[MultiFuncBase] = None  # called with ids of changed objects
 
     async def check(self):
         pass
@@ -61,19 +125,247 @@ class BaseDBModel(Model):
             ret = {}
         obj_dict = cls.get_cls_dict(obj if isinstance(obj, dict) else await obj.dict)
         if obj_db is None:
-            obj_db = cls(**obj_dict)
+            obj_db = cls(**cls.get_writable_dict(obj_dict, create=True))
         else:
-            for key, val in obj_dict.items():
-                if key not in obj_db.not_editable and (val or isinstance(val, bool)):
-                    setattr(obj_db, key, val)
+            obj_db.set_editable(cls.get_writable_dict(obj_dict))
         await obj_db.check()
-        obj_db.save()
+        if obj_db._pk is None:
+            await save(obj_db)
+        elif obj_db.dirty_fields:
+            await save(obj_db, only=obj_db.dirty_fields)
+        if cls.notifier is not None:
+            cls.notifier(obj_db.id)
         ret.update(await obj_db.dict)
         if return_obj_db:
             return ret, obj_db
         else:
             return ret
 
+    @classmethod
+    def get_visible_fields(cls, hidden: FieldHidden = FieldHidden.READ) -> list:
+        """Returns fields without hidden flag, e.g. fields that can be read"""
+        key = (cls, hidden)
+        if key not in _visible_fields:
+            _visible_fields[key] = [
+                field for field in cls._meta.sorted_fields if not FieldHidden(field._hidden or 0) & hidden
+            ]
+        return _visible_fields[key]
+
+    @classmethod
+    def get_visible_columns(cls) -> list:
+        """Returns visible fields to select rows for get_serializer, values of OptionsField are left as stored"""
+        return [field.coerce(False) if isinstance(field, OptionsField) else field for field in cls.get_visible_fields()]
+
+    @classmethod
+    def get_serializer(cls) -> Callable[[Sequence[tuple]], List[dict]]:
+        """
+        Returns function that converts rows of cls.select(*cls.get_visible_columns()).tuples() to dicts. It's made once
+        per model, so rows are serialized without awaiting dict of each object. Values of OptionsField are converted
+        to labels by columns
+        """
+        if cls not in _serializers:
+            fields = cls.get_visible_fields()
+            names = tuple(field.name for field in fields)
+            options = [(i, field) for i, field in enumerate(fields) if isinstance(field, OptionsField)]
+
+            def serialize(rows):
+                if options and rows:
+                    columns = list(zip(*rows))
+                    for i, field in options:
+                        columns[i] = field.python_values(columns[i])
+                    rows = zip(*columns)
+                return [dict(zip(names, row)) for row in rows]
+
+            _serializers[cls] = serialize
+        return _serializers[cls]
+
+    @classmethod
+    def get_writable_dict(cls, obj_dict: dict, create: bool = False) -> dict:
+        """Leaves values of fields that can be set on creation (create) or edited"""
+        names = {field.name for field in cls.get_visible_fields(FieldHidden.INIT if create else FieldHidden.EDIT)}
+        return {key: val for key, val in obj_dict.items() if key in names}
+
+    def to_dict(self) -> dict:
+        """Returns values of fields that can be read"""
+        data = self.__data__
+        return {field.name: data.get(field.name) for field in self.get_visible_fields()}
+
+    def set_editable(self, obj_dict: dict):
+        for key, val in obj_dict.items():
+            if key not in self.not_editable and (val or isinstance(val, bool)):
+                setattr(self, key, val)
+
+    def check_fields(self):
+        """Raises ValueError if required field is empty or value of OptionsField is not one of its options"""
+        for field in self._meta.sorted_fields:
+            value = self.__data__.get(field.name)
+            if value is None and not field.null and field is not self._meta.primary_key:
+                raise ValueError(f'Field "{field.name}" is required')
+            if isinstance(field, OptionsField):
+                field.db_value(value)
+
+    @classmethod
+    async def bulk_update_or_create(cls, objs: List[Any], item_class, ret=None, batch_size: int = BULK_BATCH_SIZE):
+        """
+        Validates objs by item_class and writes them by batches inside one transaction. Objects with id update
+        existing objects, others are created. Only the first object with the same id is written, a row can't be
+        updated twice by one UPDATE
+        :param objs: list of dicts
+        :param item_class: pydantic model for validation, usually made by get_class
+        :return: ret with ids of written objects and errors of not valid ones. If the transaction fails, nothing is
+            written, ids are empty and success is False with the error of database
+        """
+        if ret is None:
+            ret = {}
+        errors = []
+        rows = []  # (index, id, obj_dict)
+        seen_ids = set()
+        for i, obj in enumerate(objs):
+            try:
+                if not isinstance(obj, dict):
+                    raise TypeError('Object is expected')
+                obj_id = obj.get('id')
+                if obj_id is not None:
+                    obj_id = int(obj_id)
+                    if obj_id in seen_ids:
+                        raise ValueError(f'Object with id {obj_id} is repeated')
+                    seen_ids.add(obj_id)
+                item = item_class(**obj)
+                obj_dict = cls.get_cls_dict({key: getattr(item, key) for key in item.__fields_set__})
+                obj_dict = cls.get_writable_dict(obj_dict, create=obj_id is None)
+                rows.append((i, obj_id, obj_dict))
+            except (ValidationError, ValueError, TypeError) as e:
+                errors.append({'index': i, 'error': str(e)})
+
+        obj_ids = [obj_id for _, obj_id, _ in rows if obj_id is not None]
+        objs_db = {}
+        for i in range(0, len(obj_ids), batch_size):
+            for obj_db in await execute(cls.select().where(cls.id.in_(obj_ids[i : i + batch_size]))):
+                objs_db[obj_db.id] = obj_db
+
+        new_objs = []
+        old_objs = []
+        for i, obj_id, obj_dict in rows:
+            if obj_id is None:
+                obj_db = cls(**obj_dict)
+            elif obj_id in objs_db:
+                obj_db = objs_db[obj_id]
+                obj_db.set_editable(obj_dict)
+            else:
+                errors.append({'index': i, 'error': f'Object with id {obj_id} is not found'})
+                continue
+            try:
+                await obj_db.check()
+                obj_db.check_fields()
+            except ValueError as e:
+                errors.append({'index': i, 'error': str(e)})
+                continue
+            (new_objs if obj_id is None else old_objs).append(obj_db)
+
+        queries = list(get_bulk_queries(cls, new_objs, batch_size))
+        queries += get_bulk_queries(cls, old_objs, batch_size, update=True)
+        try:
+            ids = await execute_atomic(queries)
+        except (DatabaseError, psycopg2.Error) as e:
+            ids = []
+            ret.update({'success': False, 'error': str(e).strip()})
+        else:
+            updated = set(ids[len(new_objs) :])
+            ids = ids[: len(new_objs)] + [obj_db.id for obj_db in old_objs if obj_db.id in updated]
+            indexes = {obj_id: i for i, obj_id, _ in rows if obj_id is not None}
+            for obj_db in old_objs:
+                if obj_db.id not in updated:  # deleted after it was selected
+                    errors.append({'index': indexes[obj_db.id], 'error': f'Object with id {obj_db.id} is not found'})
+        if cls.notifier is not None and ids:
+            cls.notifier(*ids)
+        ret.update({'ids': ids, 'errors': sorted(errors, key=lambda error: error['index'])})
+        return ret
+
+    @classmethod
+    def get_csv_columns(cls, header: List[str]) -> (list, list):
+        """
+        Maps CSV header onto fields
+        :return: list of (field, converter from str) for header and list of fields with defaults missing in header
+        """
+        pk = cls._meta.primary_key
+        fields = [cls._meta.columns.get(name.strip()) or cls._meta.fields.get(name.strip()) for name in header]
+        writable = {field.name for field in cls.get_visible_fields(FieldHidden.INIT)}
+        unknown = [name for name, field in zip(header, fields) if field is None or field.name not in writable]
+        if unknown:
+            raise ValueError(f'Unknown columns: {", ".join(unknown)}')
+        names = {field.name for field in fields}
+        defaults = [field for field in cls._meta.sorted_fields if field is not pk and field.name not in names]
+        required = [field.name for field in defaults if field.default is None and not field.null]
+        if required:
+            raise ValueError(f'Required columns are missing: {", ".join(required)}')
+        return [(field, get_csv_converter(field)) for field in fields], [f for f in defaults if f.default is not None]
+
+    @classmethod
+    async def load_csv(
+        cls, rows: AsyncIterable[List[str]], ret=None, batch_size: int = COPY_BATCH_SIZE, max_errors: int = 1000
+    ):
+        """
+        Loads rows of CSV with header into the table by COPY, each batch in its own transaction
+        :param rows: async iterable of CSV rows, the first row is header with names of columns
+        :param max_errors: maximum number of errors in the result, the rest are only counted
+        :return: ret with number of loaded rows, errors of not valid rows and speed of loading. If COPY fails, loading
+            stops, success is False with the error of database and rows are the rows of batches loaded before it
+        """
+        if ret is None:
+            ret = {}
+        start = monotonic()
+        columns = defaults = None
+        batch = []
+        errors = []
+        n_rows = n_errors = 0
+        i = 0
+        try:
+            async for row in rows:
+                i += 1
+                if columns is None:
+                    columns, defaults = cls.get_csv_columns(row)
+                    continue
+                if not row:
+                    continue
+                try:
+                    if len(row) != len(columns):
+                        raise ValueError(f'{len(columns)} values are expected, got {len(row)}')
+                    values = []
+                    for value, (field, convert) in zip(row, columns):
+                        value = convert(value) if value != '' else None
+                        if value is None and not field.null:
+                            if field.default is None:
+                                raise ValueError(f'Field "{field.name}" is required')
+                            value = get_default_db_value(field)
+                        values.append(value)
+                    values.extend(get_default_db_value(field) for field in defaults)
+                    batch.append(values)
+                except (ValueError, TypeError) as e:
+                    n_errors += 1
+                    if len(errors) < max_errors:
+                        errors.append({'row': i, 'error': str(e)})
+                if len(batch) >= batch_size:
+                    n_rows += await copy_rows(cls, [field for field, _ in columns] + defaults, batch)
+                    batch = []
+            if batch:
+                n_rows += await copy_rows(cls, [field for field, _ in columns] + defaults, batch)
+        except (DatabaseError, psycopg2.Error) as e:
+            ret.update({'success': False, 'error': str(e).strip()})
+        if cls.notifier is not None and n_rows:
+            # ids of new objects are unknown, so caches are reset entirely
+            cls.notifier()
+        seconds = monotonic() - start
+        ret.update(
+            {
+                'rows': n_rows,
+                'errors': errors,
+                'errors_n': n_errors,
+                'seconds': round(seconds, 3),
+                'rows_per_second': round(n_rows / seconds) if seconds else n_rows,
+            }
+        )
+        return ret
+
     @classmethod
     def get_class(cls, name, parent, not_editable=None):
         conf = {
@@ -95,9 +387,13 @@ class BaseDBModel(Model):
         else:
             res = {key: class_val[val] for key, val in res_type.items()}
 
+        keys = tuple(res.keys())
+        get_values = operator.attrgetter(*keys)
+
         @property
         async def get_dict(self):
-            return {key: getattr(self, key) for key in res.keys()}
+            values = get_values(self)
+            return dict(zip(keys, values if len(keys) > 1 else (values,)))
 
         res['dict'] = get_dict
         return type(name, (parent,), res)
@@ -117,44 +413,347 @@ class BaseDBItem(BaseDBModel):
             self.created = datetime.now()
 
 
+def _call_in_thread(func, *args, **kwargs):
+    """Calls func with connection of the thread, results of selects are fetched in the thread"""
+    if db.is_closed():
+        db.connect()
+        _sync_connections.append(db.connection())
+    try:
+        result = func(*args, **kwargs)
+        if isinstance(result, CursorWrapper):
+            result.fill_cache()
+        return result
+    except DatabaseError:
+        connection = db.connection()
+        if connection.closed:  # connection is lost, the next call of the thread opens a new one
+            _sync_connections.remove(connection)
+            db.close()
+        raise
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Runs sync peewee call in a thread of sync_db_pool, so that the loop is not blocked. Each thread keeps its
+    connection between calls
+    """
+    return await sync_db_pool.run(_call_in_thread, func, *args, **kwargs)
+
+
+@timed('db')
 async def execute(query, *args, **kwargs):
-    return await manager.execute(query, *args, **kwargs) if DB_ASYNC else query.execute(*args, **kwargs)
+    return await manager.execute(query, *args, **kwargs) if DB_ASYNC else await run_sync(query.execute, *args, **kwargs)
 
 
+@timed('db')
 async def get_or_create(query, *args, **kwargs):
-    return await manager.get_or_create(query, *args, **kwargs) if DB_ASYNC else query.get_or_create(*args, **kwargs)
+    if DB_ASYNC:
+        return await manager.get_or_create(query, *args, **kwargs)
+    return await run_sync(query.get_or_create, *args, **kwargs)
 
 
+@timed('db')
 async def create(query, *args, **kwargs):
-    return await manager.create(query, *args, **kwargs) if DB_ASYNC else query.create(*args, **kwargs)
+    return await manager.create(query, *args, **kwargs) if DB_ASYNC else await run_sync(query.create, *args, **kwargs)
+
+
+def _get_sync(source, args, kwargs):
+    query = source if isinstance(source, ModelSelect) else source.select()
+    if args:
+        query = query.where(*args)
+    if kwargs:
+        query = query.filter(**kwargs)
+    return query.get()
+
+
+@timed('db')
+async def get_or_none(source, *args, **kwargs):
+    """
+    Returns object or None
+    :param source: model or select query, e.g. with selected fields only
+    """
+    model = source.model if isinstance(source, ModelSelect) else source
+    try:
+        if not DB_ASYNC:
+            return await run_sync(_get_sync, source, args, kwargs)
+        return await manager.get(source, *args, **kwargs)
+    except model.DoesNotExist:
+        return None
+
+
+@timed('db')
+async def save(obj, *args, **kwargs):
+    if not DB_ASYNC:
+        return await run_sync(obj.save, *args, **kwargs)
+    if obj._pk is None:
+        obj._pk = await manager.execute(type(obj).insert(**obj.__data__))
+        obj._dirty.clear()
+        return 1
+    return await manager.update(obj, *args, **kwargs)
+
+
+def get_bulk_queries(model, objs_db: list, batch_size: int = BULK_BATCH_SIZE, update=False):
+    """
+    Yields queries for objs_db by batches that return primary keys of written rows. New objects are inserted, if
+    update, editable fields of existing rows are updated by UPDATE ... FROM (VALUES ...), rows that are deleted
+    meanwhile are skipped
+    """
+    pk = model._meta.primary_key
+    fields = [field for field in model._meta.sorted_fields if field is not pk]
+    if update:
+        editable = {field.name for field in model.get_visible_fields(FieldHidden.EDIT)}
+        fields = [pk] + [field for field in fields if field.name in editable and field.name not in model.not_editable]
+        # types of VALUES columns are not known to postgres, so they are cast to types of the table, ids are integers
+        ctx = model._meta.database.get_sql_context()
+        types = [field.ddl_datatype(ctx).sql for field in fields[1:]]
+    for i in range(0, len(objs_db), batch_size):
+        batch = objs_db[i : i + batch_size]
+        if not update:
+            yield model.insert_many(
+                [tuple(obj_db.__data__.get(field.name) for field in fields) for obj_db in batch], fields=fields
+            ).returning(pk).tuples()
+            continue
+        rows = [tuple(field.db_value(obj_db.__data__.get(field.name)) for field in fields) for obj_db in batch]
+        values = ValuesList(rows, columns=[field.column_name for field in fields], alias='v')
+        columns = [Cast(getattr(values.c, field.column_name), type_) for field, type_ in zip(fields[1:], types)]
+        query = model.update(dict(zip(fields[1:], columns))).from_(values)
+        yield query.where(pk == getattr(values.c, pk.column_name)).returning(pk).tuples()
+
+
+def _execute_atomic_sync(queries) -> list:
+    result = []
+    with db.atomic():
+        for query in queries:
+            result.extend(row[0] for row in query.execute())
+    return result
+
+
+@timed('db')
+async def execute_atomic(queries) -> list:
+    """Executes queries with RETURNING inside one transaction, returns first values of all returned rows"""
+    if not DB_ASYNC:
+        return await run_sync(_execute_atomic_sync, queries)
+    result = []
+    async with manager.atomic():
+        for query in queries:
+            # peewee_async returns only the first row of INSERT with one returned column, raw query returns all rows
+            sql, params = query.sql()
+            result.extend(row[0] for row in await manager.execute(query.model.raw(sql, *params).tuples()))
+    return result
+
+
+CSV_BOOLS = {
+    **dict.fromkeys(('true', 't', 'yes', 'y', 'on', '1'), True),
+    **dict.fromkeys(('false', 'f', 'no', 'n', 'off', '0'), False),
+}
+
+
+def csv_to_bool(value: str) -> bool:
+    try:
+        return CSV_BOOLS[value.strip().lower()]
+    except KeyError:
+        raise ValueError(f'Not a boolean: {value}')
+
+
+def get_default_db_value(field):
+    return field.db_value(field.default() if callable(field.default) else field.default)
+
+
+def get_csv_converter(field):
+    """Returns function that converts CSV value to value for COPY"""
+    if isinstance(field, OptionsField):
+        return field.db_value
+    if isinstance(field, BooleanField):
+        return csv_to_bool
+    if isinstance(field, DateTimeField):
+        return datetime.fromisoformat
+    if isinstance(field, DateField):
+        return date.fromisoformat
+    if isinstance(field, (IntegerField, ForeignKeyField)):
+        return int
+    if isinstance(field, (FloatField, DoubleField)):
+        return float
+    return str
+
+
+def _copy_rows_sync(table: str, columns: List[str], rows: list) -> int:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with db.atomic():
+        db.cursor().copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+    return len(rows)
+
+
+@timed('db')
+async def copy_rows(model, fields: list, rows: list) -> int:
+    """
+    Loads rows into the table of model by COPY FROM STDIN in one transaction. aiopg doesn't support COPY, so it's done
+    by sync connection of a thread of sync_db_pool
+    :param fields: fields of model in order of values in rows
+    :param rows: lists of python values, None is loaded as NULL
+    :return: number of loaded rows
+    """
+    quote = db.obj.quote if db.obj is not None else '""'
+    table = f'{quote[0]}{model._meta.table_name}{quote[1]}'
+    columns = [f'{quote[0]}{field.column_name}{quote[1]}' for field in fields]
+    return await run_sync(_copy_rows_sync, table, columns, rows)
+
+
+FILTER_OPERATORS = {
+    '': operator.eq,
+    'gt': lambda value, other: value is not None and value > other,
+    'gte': lambda value, other: value is not None and value >= other,
+    'lt': lambda value, other: value is not None and value < other,
+    'lte': lambda value, other: value is not None and value <= other,
+}
 
 
 class BaseDBCache:
+    """
+    In-memory cache of objects of _model. Fields in indexed have hash indexes for equality filters, fields in
+    range_indexed have sorted indexes for range filters like price__gte=10
+    """
+
     data_dict: dict = {}
     data_obj: dict = {}
     _model = BaseDBItem
+    indexed: tuple = ()
+    range_indexed: tuple = ()
+    _hash_index: dict = {}  # field: {value: set of ids}
+    _sorted_index: dict = {}  # field: sorted list of (value, id)
+    _last_id = 0
+    _stale: set = set()  # ids of invalidated objects, they are reloaded by update
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.clear()
 
     @classmethod
-    async def update(cls) -> dict:
+    def clear(cls):
         cls.data_dict = {}
         cls.data_obj = {}
-        for obj in await execute(cls._model.select()):
-            cls.data_dict[obj.id] = await obj.dict
-            cls.data_obj[obj.id] = obj
+        cls._hash_index = {name: defaultdict(set) for name in cls.indexed}
+        cls._sorted_index = {name: [] for name in cls.range_indexed}
+        cls._last_id = 0
+        cls._stale = set()
+
+    @classmethod
+    async def update(cls, full: bool = False) -> dict:
+        """
+        Loads objects created since the last update and invalidated objects
+        :param full: reload all objects
+        """
+        if full:
+            cls.clear()
+        model = cls._model
+        last_id, stale = cls._last_id, cls._stale
+        cls._stale = set()
+        query = model.id > last_id
+        if stale:
+            query |= model.id.in_(list(stale))
+        objs = await execute(model.select().where(query).order_by(model.id))
+        for obj in objs:
+            cls._remove(obj.id)
+            await cls._add(obj, keep_sorted=False)
+            cls._last_id = max(cls._last_id, obj.id)
+        if objs:
+            for index in cls._sorted_index.values():
+                index.sort()
         return cls.data_dict
 
+    @classmethod
+    async def refresh(cls, *ids) -> dict:
+        """Reloads objects by ids after they are changed, deleted objects are removed"""
+        for obj_id in ids:
+            cls._remove(obj_id)
+        if ids:
+            for obj in await execute(cls._model.select().where(cls._model.id.in_(ids))):
+                await cls._add(obj)
+        return cls.data_dict
+
+    @classmethod
+    def invalidate(cls, *ids):
+        """
+        Removes objects by ids, they are reloaded by the next update. Only ids that are already loaded are kept,
+        newer ids are loaded by update anyway, so nothing is kept before the first update
+        """
+        for obj_id in ids:
+            cls._remove(obj_id)
+            if obj_id <= cls._last_id:
+                cls._stale.add(obj_id)
+
+    @classmethod
+    async def _add(cls, obj, keep_sorted=True):
+        cls.data_dict[obj.id] = await obj.dict
+        cls.data_obj[obj.id] = obj
+        for name, index in cls._hash_index.items():
+            index[getattr(obj, name)].add(obj.id)
+        for name, index in cls._sorted_index.items():
+            value = getattr(obj, name)
+            if value is not None:
+                if keep_sorted:
+                    insort(index, (value, obj.id))
+                else:
+                    index.append((value, obj.id))
+
+    @classmethod
+    def _remove(cls, obj_id):
+        obj = cls.data_obj.pop(obj_id, None)
+        if obj is None:
+            return
+        del cls.data_dict[obj_id]
+        for name, index in cls._hash_index.items():
+            ids = index.get(getattr(obj, name))
+            if ids is not None:
+                ids.discard(obj_id)
+                if not ids:
+                    del index[getattr(obj, name)]
+        for name, index in cls._sorted_index.items():
+            value = getattr(obj, name)
+            if value is not None:
+                i = bisect_left(index, (value, obj_id))
+                if i < len(index) and index[i] == (value, obj_id):
+                    del index[i]
+
+    @classmethod
+    def _get_range(cls, name, op, value) -> list:
+        index = cls._sorted_index[name]
+        if op == 'gt':
+            return [obj_id for _, obj_id in index[bisect_right(index, (value, math.inf)) :]]
+        elif op == 'gte':
+            return [obj_id for _, obj_id in index[bisect_left(index, (value, -math.inf)) :]]
+        elif op == 'lt':
+            return [obj_id for _, obj_id in index[: bisect_left(index, (value, -math.inf))]]
+        else:
+            return [obj_id for _, obj_id in index[: bisect_right(index, (value, math.inf))]]
+
     @classmethod
     def filter(cls, **kwargs) -> dict:
-        result = {}
-        for key, item in cls.data_obj.items():
-            check = True
-            for fkey, fval in kwargs.items():
-                if getattr(item, fkey) != fval:
-                    check = False
-                    break
-            if check:
-                result[key] = item
-        return result
+        """
+        Filters objects by field=value and field__gt, field__gte, field__lt, field__lte. Filters by indexed fields
+        are done by indexes, others by scanning the objects left after them
+        """
+        ids = None
+        rest = []
+        for key, val in kwargs.items():
+            name, _, op = key.partition('__')
+            if op not in FILTER_OPERATORS:
+                raise ValueError(f'Unknown filter "{key}"')
+            if not op and name in cls._hash_index:
+                found = cls._hash_index[name].get(val, ())
+            elif op and name in cls._sorted_index:
+                found = cls._get_range(name, op, val)
+            else:
+                rest.append((name, FILTER_OPERATORS[op], val))
+                continue
+            ids = set(found) if ids is None else ids.intersection(found)
+            if not ids:
+                return {}
+
+        objs = cls.data_obj if ids is None else {key: cls.data_obj[key] for key in sorted(ids)}
+        if not rest:
+            return dict(objs)
+        return {key: item for key, item in objs.items() if all(op(getattr(item, name), val) for name, op, val in rest)}
 
     @classmethod
     def filter_dict(cls, **kwargs) -> dict:
@@ -1,8 +1,6 @@
-from typing import Union, Iterable, Mapping, Any
+from typing import Union, Iterable, Mapping, Sequence, Any, List
 import peewee
 
-from backend.library.decorators.cache import unified
-
 
 class OptionsField(peewee.IntegerField):
     def __init__(
@@ -20,6 +18,12 @@ class OptionsField(peewee.IntegerField):
                     assert isinstance(i, int), f'All keys for {self.__class__.__name__} should be int'
 
         self._options = options
+        # both dicts accept labels and ints, so conversion of a value is a single lookup
+        self._db_values = {None: None} if options is None else {None: None, **{i: i for i in options}}
+        self._python_values = {None: None} if options is None else {None: None, **options}
+        if options is not None:
+            self._db_values.update({item: i for i, item in options.items()})
+            self._python_values.update({item: item for item in options.values() if item not in options})
 
         super().__init__(*args, **kwargs)
 
@@ -31,19 +35,29 @@ class OptionsField(peewee.IntegerField):
         return self.options.__contains__(item)
 
     def python_value(self, value):
-        if value is not None:
+        try:
+            return self._python_values[value]
+        except KeyError:
             if isinstance(value, int):
-                return self._options[value]
-            elif isinstance(value, str) and value in self._options.values():
-                return value
+                raise ValueError(f'There\'s no option with value {value}')
+            return None
 
-    @unified
     def db_value(self, value):
-        if value is None:
-            return
-        for i, item in self._options.items():
-            if value == item:
-                return i
-        if value in self._options:
-            return value
-        raise ValueError(f'There\'s no such option "{value}"')
+        try:
+            return self._db_values[value]
+        except (KeyError, TypeError):
+            raise ValueError(f'There\'s no such option "{value}"')
+
+    def python_values(self, values: Sequence) -> List:
+        """Converts column of values from database to labels, raises ValueError for unknown values"""
+        try:
+            return list(map(self._python_values.__getitem__, values))
+        except KeyError:
+            return [self.python_value(value) for value in values]
+
+    def db_values(self, values: Sequence) -> List[int]:
+        """Converts column of labels to values for database, raises ValueError for unknown labels"""
+        try:
+            return [self._db_values[value] for value in values]
+        except (KeyError, TypeError):
+            return [self.db_value(value) for value in values]
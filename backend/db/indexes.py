@@ -0,0 +1,58 @@
+from typing import List, Tuple
+from peewee import Model
+
+
+def get_model_indexes(model) -> List[Tuple[Tuple[str, ...], bool]]:
+    """
+    Returns indexes declared on model: fields with index=True or unique=True and Meta.indexes like
+    ((('field1', 'field2'), unique), ...)
+    :return: list of (field names, unique)
+    """
+    indexes = []
+    for field in model._meta.sorted_fields:
+        if not field.primary_key and (field.index or field.unique):
+            indexes.append(((field.name,), bool(field.unique)))
+    for index in model._meta.indexes:
+        if isinstance(index, (list, tuple)):  # peewee Index objects and SQL are not supported
+            fields, unique = index
+            indexes.append((tuple(fields), bool(unique)))
+    return indexes
+
+
+def filter_indexes(model, names) -> List[Tuple[Tuple[str, ...], bool]]:
+    indexes = get_model_indexes(model)
+    if not names:
+        return indexes
+    indexes = [(fields, unique) for fields, unique in indexes if set(fields) & set(names)]
+    unknown = set(names).difference(*(fields for fields, _ in indexes))
+    assert not unknown, f'There are no indexes on {", ".join(sorted(unknown))} in {model.__name__}'
+    return indexes
+
+
+def format_indexes(model: Model, *names: str) -> str:
+    """
+    Returns calls of migrator.add_index for indexes declared on model, to be pasted into a new migration. Migrations
+    spell out tables and columns, so that later changes of model don't change what they do
+    """
+    table = model._meta.table_name
+    return '\n'.join(
+        f"migrator.add_index({table!r}, {', '.join(map(repr, fields))}, unique={unique})"
+        for fields, unique in filter_indexes(model, names)
+    )
+
+
+def migrate_indexes(migrator, model: Model, *names: str):
+    """
+    Adds to migration indexes declared on model, as they are at the time of running the migration
+    :param migrator: migrator of peewee_migrate, table of model should be created by previous migrations
+    :param model: current model, e.g. subclass of BaseDBModel
+    :param names: names of fields, only indexes with them are added. All indexes if not specified
+    """
+    for fields, unique in filter_indexes(model, names):
+        migrator.add_index(model._meta.table_name, *fields, unique=unique)
+
+
+def rollback_indexes(migrator, model: Model, *names: str):
+    """Drops indexes added by migrate_indexes with the same arguments"""
+    for fields, _ in filter_indexes(model, names):
+        migrator.drop_index(model._meta.table_name, *fields)
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, perf_counter
+from typing import Optional
+from peewee_async import AsyncPostgresqlConnection
+from peewee_asyncext import PooledPostgresqlExtDatabase, PostgresqlExtDatabase
+
+from backend.db.query_stats import QueryStats, query_stats, EXPLAIN_PREFIX
+from backend.library.coro import start_coro
+from backend.library.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    def __init__(self):
+        self.waiters = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.acquire_time = Histogram()
+
+
+class TimedCursor:
+    """Async cursor that adds time of statements to query stats and captures plans of slow statements"""
+
+    def __init__(self, cursor, connection: 'InstrumentedPostgresqlConnection', stats: QueryStats = query_stats):
+        self._cursor = cursor
+        self._connection = connection
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    async def execute(self, operation, parameters=None, *args, **kwargs):
+        started = perf_counter()
+        result = await self._cursor.execute(operation, parameters, *args, **kwargs)
+        fingerprint = self._stats.observe(operation, perf_counter() - started)
+        if fingerprint is not None:
+            start_coro(self._connection.explain(fingerprint, operation, parameters, self._stats))
+        return result
+
+
+class InstrumentedPostgresqlConnection(AsyncPostgresqlConnection):
+    """
+    Connection pool that measures time of acquiring connections and limits it with acquire_timeout. Its cursors
+    measure time of statements
+    """
+
+    def __init__(self, *, acquire_timeout: Optional[float] = None, pool_stats: PoolStats = None, **kwargs):
+        super().__init__(**kwargs)
+        self.acquire_timeout = acquire_timeout
+        self.pool_stats = pool_stats or PoolStats()
+
+    async def cursor(self, conn=None, *args, **kwargs):
+        return TimedCursor(await super().cursor(conn, *args, **kwargs), self)
+
+    async def explain(self, fingerprint: str, sql: str, params, stats: QueryStats = query_stats):
+        """
+        Captures plan by a separate connection, so that the transaction of the statement is not affected. The
+        statement is executed again in a transaction that is rolled back
+        """
+        conn = await self.acquire()
+        try:
+            cursor = await conn.cursor()
+            try:
+                await cursor.execute('BEGIN')
+                try:
+                    started = perf_counter()
+                    await cursor.execute(EXPLAIN_PREFIX + sql, params)
+                    stats.set_plan(fingerprint, await cursor.fetchall(), perf_counter() - started)
+                finally:
+                    await cursor.execute('ROLLBACK')
+            finally:
+                cursor.close()
+        except Exception:
+            logger.exception('Plan of slow query is not captured')
+        finally:
+            self.release(conn)
+
+    async def acquire(self):
+        stats = self.pool_stats
+        stats.waiters += 1
+        started = monotonic()
+        try:
+            if self.acquire_timeout:
+                conn = await asyncio.wait_for(self.pool.acquire(), self.acquire_timeout)
+            else:
+                conn = await self.pool.acquire()
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            raise
+        finally:
+            stats.waiters -= 1
+        stats.acquired += 1
+        stats.acquire_time.observe(monotonic() - started)
+        return conn
+
+
+class QueryStatsMixin:
+    """Mixin for databases that adds time of sync statements to query stats and uses instrumented async connections"""
+
+    query_stats: QueryStats = query_stats
+    explain_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+
+    def init(self, database, **kwargs):
+        super().init(database, **kwargs)
+        self._async_conn_cls = InstrumentedPostgresqlConnection
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        started = perf_counter()
+        cursor = super().execute_sql(sql, params, *args, **kwargs)
+        fingerprint = self.query_stats.observe(sql, perf_counter() - started)
+        if fingerprint is not None:
+            self.explain_executor.submit(self.explain, fingerprint, sql, params)
+        return cursor
+
+    def explain(self, fingerprint: str, sql: str, params):
+        """
+        Captures plan by a separate connection of the explain thread, so that the request doesn't wait for it. The
+        statement is executed again in a transaction that is rolled back
+        """
+        try:
+            with self.connection_context(), self.manual_commit():
+                self.begin()
+                try:
+                    started = perf_counter()
+                    rows = super().execute_sql(EXPLAIN_PREFIX + sql, params).fetchall()
+                    self.query_stats.set_plan(fingerprint, rows, perf_counter() - started)
+                finally:
+                    self.rollback()
+        except Exception:
+            logger.exception('Plan of slow query is not captured')
+
+
+class InstrumentedPostgresqlExtDatabase(QueryStatsMixin, PostgresqlExtDatabase):
+    """PostgresqlExtDatabase with query stats, it has a single async connection"""
+
+
+class PooledDatabase(QueryStatsMixin, PooledPostgresqlExtDatabase):
+    """
+    PooledPostgresqlExtDatabase with recycling of stale connections, limited time of acquiring connection and stats
+
+    :param stale_timeout: seconds after which connection is recycled, -1 to disable
+    :param acquire_timeout: seconds to wait for free connection, None to wait forever
+    """
+
+    def init(self, database, stale_timeout: float = -1, acquire_timeout: Optional[float] = None, **kwargs):
+        self.stale_timeout = stale_timeout
+        self.acquire_timeout = acquire_timeout
+        self.pool_stats = PoolStats()
+        super().init(database, **kwargs)
+
+    @property
+    def connect_params_async(self):
+        kwargs = super().connect_params_async
+        kwargs.update(
+            {
+                'pool_recycle': self.stale_timeout,
+                'acquire_timeout': self.acquire_timeout,
+                'pool_stats': self.pool_stats,
+            }
+        )
+        return kwargs
+
+    def get_stats(self) -> dict:
+        pool = self._async_conn.pool if self._async_conn else None
+        return {
+            'min_connections': self.min_connections,
+            'max_connections': self.max_connections,
+            'size': pool.size if pool else 0,
+            'idle': pool.freesize if pool else 0,
+            'in_use': pool.size - pool.freesize if pool else 0,
+            'waiters': self.pool_stats.waiters,
+            'acquired': self.pool_stats.acquired,
+            'timeouts': self.pool_stats.timeouts,
+            'acquire_seconds': self.pool_stats.acquire_time.as_dict(),
+        }
@@ -0,0 +1,165 @@
+import logging
+import math
+import random
+import re
+import threading
+from functools import lru_cache
+from time import monotonic
+from typing import Dict, List, Optional
+
+from backend.config import (
+    QUERY_STATS_ENABLED,
+    QUERY_STATS_SLOW_MS,
+    QUERY_STATS_EXPLAIN,
+    QUERY_STATS_EXPLAIN_INTERVAL,
+    QUERY_STATS_MAX_N,
+)
+
+logger = logging.getLogger(__name__)
+
+EXPLAIN_PREFIX = 'EXPLAIN (ANALYZE, BUFFERS) '
+OTHER = 'other'  # fingerprint of statements above max_n fingerprints
+# SELECTs that lock rows, create tables or call functions with side effects are not executed again by EXPLAIN ANALYZE
+_unsafe_select = re.compile(
+    r'\bFOR\s+(?:NO\s+KEY\s+)?UPDATE\b|\bFOR\s+(?:KEY\s+)?SHARE\b|\bINTO\b'
+    r'|\b(?:nextval|setval|pg_(?:try_)?advisory_\w+|pg_notify|lo_\w+)\s*\(',
+    re.IGNORECASE,
+)
+
+_normalizers = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),  # string literals
+    (re.compile(r'%s|\$\d+'), '?'),  # placeholders
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),  # numbers
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*'), '(...)'),  # IN and VALUES lists
+    (re.compile(r'\s+'), ' '),
+]
+
+
+@lru_cache(maxsize=4096)
+def get_fingerprint(sql: str) -> str:
+    """Normalizes SQL, so that statements that differ only by values have the same fingerprint"""
+    for pattern, replacement in _normalizers:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def is_explainable(sql: str) -> bool:
+    """Checks that the statement is a SELECT that can be executed again by EXPLAIN ANALYZE without side effects"""
+    return sql.lstrip()[:6].upper() == 'SELECT' and not _unsafe_select.search(sql)
+
+
+class QueryStat:
+    """Count, total time and reservoir sample of times of one fingerprint"""
+
+    reservoir_size = 256
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.sample: List[float] = []
+        self.plan: Optional[dict] = None
+        self.explained_at = -math.inf
+
+    def observe(self, seconds: float, slow: bool):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.slow += slow
+        if len(self.sample) < self.reservoir_size:
+            self.sample.append(seconds)
+        else:
+            i = random.randrange(self.count)
+            if i < self.reservoir_size:
+                self.sample[i] = seconds
+
+    def percentile(self, percent: float) -> float:
+        values = sorted(self.sample)
+        return values[max(0, math.ceil(len(values) * percent / 100) - 1)] if values else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'total': round(self.total, 6),
+            'mean': round(self.total / self.count, 6) if self.count else 0.0,
+            'p95': round(self.percentile(95), 6),
+            'max': round(self.max, 6),
+            'slow': self.slow,
+            'plan': self.plan,
+        }
+
+
+class QueryStats:
+    """
+    Aggregates time of SQL statements by fingerprint. Statements slower than slow_ms are logged and, if explain is
+    on, plans of slow SELECTs without side effects are captured by EXPLAIN (ANALYZE, BUFFERS) at most once per explain_interval seconds
+    for each fingerprint. Sync statements are observed in threads of sync queries, so data is changed under lock
+    """
+
+    def __init__(
+        self,
+        enabled: bool = QUERY_STATS_ENABLED,
+        slow_ms: float = QUERY_STATS_SLOW_MS,
+        explain: bool = QUERY_STATS_EXPLAIN,
+        explain_interval: float = QUERY_STATS_EXPLAIN_INTERVAL,
+        max_n: int = QUERY_STATS_MAX_N,
+    ):
+        self.enabled = enabled
+        self.slow_seconds = slow_ms / 1000
+        self.explain = explain
+        self.explain_interval = explain_interval
+        self.max_n = max_n
+        self.data: Dict[str, QueryStat] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, sql: str, seconds: float) -> Optional[str]:
+        """
+        Adds time of the statement
+        :return: fingerprint if plan of the statement should be captured, else None
+        """
+        if not self.enabled or sql.startswith(EXPLAIN_PREFIX):
+            return None
+        fingerprint = get_fingerprint(sql)
+        slow = seconds >= self.slow_seconds
+        with self._lock:
+            stat = self.data.get(fingerprint)
+            if stat is None:
+                if len(self.data) >= self.max_n:
+                    fingerprint = OTHER
+                    stat = self.data.get(OTHER)
+                if stat is None:
+                    stat = self.data[fingerprint] = QueryStat()
+            stat.observe(seconds, slow)
+            if not slow:
+                return None
+            explain = self.explain and fingerprint != OTHER and is_explainable(fingerprint)
+            now = monotonic()
+            if explain and now - stat.explained_at >= self.explain_interval:
+                stat.explained_at = now
+            else:
+                explain = False
+        logger.warning('Slow query %.1f ms: %s', seconds * 1000, fingerprint)
+        return fingerprint if explain else None
+
+    def set_plan(self, fingerprint: str, rows: list, seconds: float):
+        with self._lock:
+            stat = self.data.get(fingerprint)
+            if stat is not None:
+                stat.plan = {'seconds': round(seconds, 6), 'plan': [row[0] for row in rows]}
+
+    def stats(self, order_by: str = 'total', limit: Optional[int] = None) -> List[dict]:
+        """
+        :param order_by: total, p95, mean, max, count or slow, the largest first
+        """
+        with self._lock:
+            result = [{'fingerprint': fingerprint, **stat.as_dict()} for fingerprint, stat in self.data.items()]
+        result.sort(key=lambda item: item[order_by], reverse=True)
+        return result[:limit] if limit else result
+
+    def clear(self):
+        with self._lock:
+            self.data = {}
+
+
+query_stats = QueryStats()
@@ -11,6 +11,7 @@ from fastapi.security import OAuth2
 from fastapi.security.utils import get_authorization_scheme_param
 
 from backend.db.base import get_or_create
+from backend.library.tokens import get_token_verifier
 
 
 AUTH_TOKEN_NAME = 'Token'
@@ -108,6 +109,7 @@ class TokenAuthenticator(Authenticator):
     def __init__(self, user_model, jwt_token, data_dir: str = None):
         self.user_model = user_model
         self.JWT_TOKEN = jwt_token
+        self.verifier = get_token_verifier(jwt_token)
         self.DATA_DIR = data_dir
 
     def applicable_to(self, handler: Request):
@@ -142,12 +144,7 @@ class TokenAuthenticator(Authenticator):
             return str(e)
 
     def verify_token(self, token):
-        try:
-            data = jwt.decode(token, self.JWT_TOKEN)
-            assert 'exp' in data
-            return data
-        except AssertionError:
-            raise jwt.exceptions.InvalidTokenError()
+        return self.verifier.verify(token)
 
 
 class CustomTokenAuthenticator(TokenAuthenticator):
@@ -223,4 +220,4 @@ def generate_token(data: dict = None, jwt_token: str = None) -> str:
         data = {}
     ttl = timedelta(days=1)
     data.update({'exp': (datetime.now() + ttl).timestamp()})
-    return jwt.encode(data, jwt_token, algorithm='HS256').decode()
+    return get_token_verifier(jwt_token).encode(data)
@@ -1,62 +1,204 @@
+import asyncio
+import heapq
 from collections import OrderedDict
-from datetime import timedelta, datetime
+from collections.abc import MutableMapping
+from datetime import timedelta
+from itertools import count
+from time import monotonic
+from typing import Union, Optional
 
-from backend.library.coro import start_coro, coro_func
+from backend.library.coro import on_shutdown
 
+_sweepers = set()  # running sweeper tasks of all dicts, they are cancelled on app shutdown
 
-class TemporaryDict(OrderedDict):
-    """dict for temporary storing. Usually used as cache"""
 
-    def __init__(self, ttl: timedelta = None, max_n=None, auto_clean=True, **kwargs):
-        super().__init__(**kwargs)
-        self._ttl = ttl
+class TemporaryDict(MutableMapping):
+    """
+    dict for temporary storing. Usually used as cache
+
+    Items are kept in LRU order and expire after ttl. Expired items are removed on access and by the single sweeper
+    task of the dict, which sleeps until the nearest expiration time. The sweeper is cancelled by close(), sweepers of
+    all dicts are closed on app shutdown
+    """
+
+    def __init__(self, ttl: Union[timedelta, float] = None, max_n=None, auto_clean=True, **kwargs):
+        """
+        :param ttl: time to live for each item, timedelta or seconds
+        :param max_n: maximum number of items, least recently used items are evicted above it
+        :param auto_clean: evict items above max_n on every insert
+        """
+        self._ttl = ttl.total_seconds() if isinstance(ttl, timedelta) else ttl
         self.max_n = max(max_n, 1) if max_n else None
         self.auto_clean = auto_clean
+        self._data = OrderedDict()  # key: (value, expire_at)
+        self._heap = []  # (expire_at, n, key), may contain outdated entries
+        self._counter = count()
+        self._sweeper: Optional[asyncio.Task] = None
+        self._sweeper_at: Optional[float] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.update(kwargs)
 
     def __contains__(self, key):
-        key = str(key)
-        if super().__contains__(key):
-            if self._ttl:
-                item = super().__getitem__(key)
-                if datetime.now() - item[1] >= self._ttl:
-                    del self[key]
-                    return False
-                else:
-                    return True
-            else:
-                return True
-        else:
+        item = self._data.get(key)
+        if item is None:
             return False
+        if item[1] is not None and item[1] <= monotonic():
+            self._expire(key)
+            return False
+        return True
 
     def __getitem__(self, key):
-        key = str(key)
-        self.__contains__(key)
-        return super().__getitem__(key)[0]
+        item = self._data.get(key)
+        if item is not None:
+            if item[1] is None or item[1] > monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            self._expire(key)
+        self.misses += 1
+        raise KeyError(key)
 
     def get(self, key, default=None):
-        key = str(key)
-        self.__contains__(key)
-        return super().get(key, (default, None))[0]
-
-    def clean(self):
-        # todo add Limit class
-        while self.max_n and len(self) > self.max_n:
-            try:
-                self.popitem(False)  # todo add buffer before deletion
-            except KeyError:
-                pass
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
-    def __setitem__(self, key, value):
-        key = str(key)
+    def set(self, key, value, ttl: Union[timedelta, float] = None):
+        """
+        Sets item
+        :param ttl: time to live for the item, ttl of the dict if not specified
+        """
+        if ttl is None:
+            ttl = self._ttl
+        elif isinstance(ttl, timedelta):
+            ttl = ttl.total_seconds()
+        expire_at = monotonic() + ttl if ttl else None
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = (value, expire_at)
+        if expire_at is not None:
+            self._schedule(key, expire_at)
         if self.auto_clean:
-            self.clean()
-        args = key, (value, datetime.now())
-        super().__setitem__(*args)
+            self._evict()
 
-        # to prevent memory leak
-        if self._ttl:
-            start_coro(coro_func(self.__contains__, key), self._ttl)
+    def __setitem__(self, key, value):
+        self.set(key, value)
 
     def __delitem__(self, key):
-        key = str(key)
-        super().__delitem__(key)
+        del self._data[key]
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+    def items(self):
+        now = monotonic()
+        return [(key, item[0]) for key, item in self._data.items() if item[1] is None or item[1] > now]
+
+    def values(self):
+        now = monotonic()
+        return [item[0] for item in self._data.values() if item[1] is None or item[1] > now]
+
+    def popitem(self, last=True):
+        key, item = self._data.popitem(last)
+        return key, item[0]
+
+    def clear(self):
+        self._data.clear()
+        self._heap.clear()
+
+    async def close(self):
+        """Cancels the sweeper, it's started again by the next item with ttl"""
+        sweeper, self._sweeper, self._sweeper_at = self._sweeper, None, None
+        if sweeper is not None:
+            await _cancel(sweeper)
+
+    def clean(self):
+        """Removes expired items and evicts least recently used items above max_n"""
+        self._sweep(monotonic())
+        self._evict()
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'max_n': self.max_n,
+            'ttl': self._ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def _evict(self):
+        while self.max_n and len(self._data) > self.max_n:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def _expire(self, key):
+        del self._data[key]
+        self.expirations += 1
+
+    def _sweep(self, now: float):
+        while self._heap and self._heap[0][0] <= now:
+            expire_at, _, key = heapq.heappop(self._heap)
+            item = self._data.get(key)
+            if item is not None and item[1] == expire_at:
+                self._expire(key)
+
+    def _compact(self):
+        """Rebuilds heap from items, so that entries of overwritten and removed items don't take memory"""
+        self._heap = [
+            (expire_at, next(self._counter), key) for key, (_, expire_at) in self._data.items() if expire_at is not None
+        ]
+        heapq.heapify(self._heap)
+
+    def _schedule(self, key, expire_at: float):
+        heapq.heappush(self._heap, (expire_at, next(self._counter), key))
+        if len(self._heap) > 2 * max(len(self._data), self.max_n or 0):
+            self._compact()
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # without loop items are removed on access and by clean()
+            return
+        sweeper = self._sweeper
+        if sweeper is None or sweeper.done() or sweeper.get_loop() is not loop:
+            self._sweeper = _start_sweeper(loop, self._run_sweeper())
+        elif self._sweeper_at is not None and expire_at < self._sweeper_at:
+            sweeper.cancel()
+            self._sweeper = _start_sweeper(loop, self._run_sweeper())
+
+    async def _run_sweeper(self):
+        while self._heap:
+            self._sweeper_at = self._heap[0][0]
+            await asyncio.sleep(max(self._sweeper_at - monotonic(), 0))
+            self._sweep(monotonic())
+        self._sweeper_at = None
+
+
+def _start_sweeper(loop, coro) -> asyncio.Task:
+    task = loop.create_task(coro)
+    _sweepers.add(task)
+    task.add_done_callback(_sweepers.discard)
+    return task
+
+
+async def _cancel(task: asyncio.Task):
+    if not task.done():
+        task.cancel()
+        if task.get_loop() is asyncio.get_running_loop():
+            await asyncio.gather(task, return_exceptions=True)
+
+
+async def close_sweepers():
+    for task in list(_sweepers):
+        await _cancel(task)
+
+
+on_shutdown.add(close_sweepers)
@@ -6,26 +6,34 @@ from asyncio import (
     iscoroutine,
     wait,
 )
+from concurrent.futures import Executor, ProcessPoolExecutor
 from datetime import timedelta
-from typing import Union
+from typing import Union, Optional, Type
 import logging
-import traceback
 import aiostream
 
-from backend.library.func import call_func
+from backend.library.func import call_func, MultiFuncAsync
+
+
+logger = logging.getLogger(__name__)
+_last_loop = None
+on_shutdown = MultiFuncAsync()  # coroutine functions awaited on app shutdown, e.g. for flushing buffers
 
 
 def get_loop():
     """
-    :return: current loop
+    :return: running loop, loop of current thread or last running loop for threads without loop
     """
+    global _last_loop
+    try:
+        _last_loop = asyncio.get_running_loop()
+        return _last_loop
+    except RuntimeError:
+        pass
     try:
         return asyncio.get_event_loop()
     except RuntimeError:
-        return loop
-
-
-loop = get_loop()
+        return _last_loop
 
 
 async def run_coro_after(coro, time: Union[float, timedelta]):
@@ -81,15 +89,111 @@ async def maybe_coro(func, *args, __to_executor=False, **kwargs):
         return func
 
 
-async def coro_func(func, *args, **kwargs):
+async def coro_func(func, *args, __executor: Optional[Executor] = None, **kwargs):
     """
     Makes coro from sync function
     :param func:
     :param args:
+    :param __executor: executor to run func in, default executor of the loop if not specified
     :param kwargs:
     :return: running coro in executor
     """
-    return await get_loop().run_in_executor(None, call_func, func, args, kwargs)
+    return await run_in_executor(__executor, func, *args, **kwargs)
+
+
+async def run_in_executor(executor: Optional[Executor], func, *args, **kwargs):
+    """
+    Runs sync function in executor
+    :param executor: executor to run func in, default executor of the loop if None
+    :param func:
+    :param args:
+    :param kwargs:
+    :return: result of func
+    """
+    return await get_loop().run_in_executor(executor, call_func, func, args, kwargs)
+
+
+class ExecutorPool:
+    """Executor with limited number of simultaneously submitted jobs. Other jobs wait in the loop"""
+
+    def __init__(
+        self,
+        executor_class: Type[Executor] = ProcessPoolExecutor,
+        max_workers: Optional[int] = None,
+        max_concurrent: Optional[int] = None,
+    ):
+        """
+        :param executor_class: class of executor to be created on first use
+        :param max_workers: number of workers of executor
+        :param max_concurrent: number of jobs submitted to executor at the same time
+        """
+        self.executor_class = executor_class
+        self.max_workers = max_workers
+        self.max_concurrent = max_concurrent or max_workers or 1
+        self._executor: Optional[Executor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop = None
+        self.running = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self.executor_class(max_workers=self.max_workers)
+        return self._executor
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        cur_loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not cur_loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+            self._semaphore_loop = cur_loop
+        return self._semaphore
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs func in executor, waits if there are already max_concurrent running jobs
+        :param func: picklable function if executor is ProcessPoolExecutor
+        :return: result of func
+        """
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        semaphore = self.semaphore
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            result = await run_in_executor(self.executor, func, *args, **kwargs)
+            self.completed += 1
+            return result
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.running -= 1
+            semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            'executor': self.executor_class.__name__,
+            'max_workers': self.max_workers,
+            'max_concurrent': self.max_concurrent,
+            'running': self.running,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
 
 
 async def run_on_interval(corofunc, *args, wait_time=25, **kwargs):
@@ -104,7 +208,7 @@ async def run_on_interval(corofunc, *args, wait_time=25, **kwargs):
         try:
             await corofunc(*args, **kwargs)
         except Exception:
-            traceback.print_exc()
+            logger.exception(f'{getattr(corofunc, "__name__", corofunc)} failed')
         await asyncio.sleep(wait_time)
 
 
@@ -123,7 +227,7 @@ async def remove_done_coros_from_list(coros_list, results=None):
                 results.append(await coro)
                 done_coros.append(coro)
             except Exception as e:
-                logging.warning(f'Coroutine not finished: {e}')
+                logger.warning('Coroutine not finished: %r', e)
             finally:
                 coros_list.remove(coro)
     return done_coros
@@ -0,0 +1,96 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional
+
+from backend.library.coro import start_coro
+
+logger = logging.getLogger(__name__)
+
+
+class CounterAggregator:
+    """
+    Accumulates increments of counters in process and sends them together, so that many increments of a key cost
+    one write. Counts are sent every interval seconds or as soon as there are max_pending increments
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Dict[str, int]], Awaitable],
+        interval: float = 0.5,
+        max_pending: int = 1000,
+    ):
+        """
+        :param send: coroutine function that writes dict of key: increment
+        :param interval: maximum time in seconds between an increment and its sending
+        :param max_pending: number of increments that triggers sending without waiting for interval
+        """
+        self.send = send
+        self.interval = interval
+        self.max_pending = max_pending
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._pending = 0
+        self._timer: Optional[asyncio.Task] = None
+        self._flush: Optional[asyncio.Task] = None  # flush started by max_pending, only one at a time
+        self.added = 0
+        self.sent = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def add(self, key, n: int = 1):
+        if not key:
+            return
+        self._counts[key] += n
+        self._pending += 1
+        self.added += 1
+        if self._pending >= self.max_pending and (self._flush is None or self._flush.done()):
+            self._flush = start_coro(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = start_coro(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        """Sends accumulated counts, on failure they are kept to be sent with the next flush"""
+        if not self._counts:
+            return
+        counts, pending = self._counts, self._pending
+        self._counts, self._pending = defaultdict(int), 0
+        try:
+            await self.send(counts)
+            self.flushes += 1
+            self.sent += pending
+        except Exception:
+            self.errors += 1
+            for key, n in counts.items():
+                self._counts[key] += n
+            self._pending += pending
+            logger.exception('Counters are not sent')
+            if self._timer is None or self._timer.done() or self._timer is asyncio.current_task():
+                self._timer = start_coro(self._flush_later())
+
+    async def close(self):
+        """Stops the timer and sends everything accumulated"""
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            await asyncio.gather(self._timer, return_exceptions=True)
+        self._timer = None
+        if self._flush is not None:
+            await asyncio.gather(self._flush, return_exceptions=True)
+            self._flush = None
+        await self.flush()
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def stats(self) -> dict:
+        return {
+            'keys': len(self._counts),
+            'pending': self._pending,
+            'added': self.added,
+            'sent': self.sent,
+            'flushes': self.flushes,
+            'errors': self.errors,
+        }
@@ -0,0 +1,41 @@
+import codecs
+import csv
+import io
+from typing import AsyncIterable, AsyncIterator, List
+
+
+def get_records_end(text: str, quotechar: str = '"') -> int:
+    """
+    Finds end of the last complete CSV record in text, line breaks inside quoted fields are skipped
+    :return: position after the last line break outside of quotes, 0 if there is no such line break
+    """
+    end = text.rfind('\n') + 1
+    while end > 0 and text.count(quotechar, 0, end) % 2:
+        end = text.rfind('\n', 0, end - 1) + 1
+    return end
+
+
+async def iter_csv_rows(
+    chunks: AsyncIterable[bytes], encoding: str = 'utf-8-sig', **fmtparams
+) -> AsyncIterator[List[str]]:
+    """
+    Parses CSV incrementally from chunks of bytes, so the whole file is never kept in memory
+    :param chunks: async iterable of bytes, chunks can be split at any place
+    :param encoding: encoding of CSV, BOM is skipped by default
+    :param fmtparams: params for csv.reader
+    :return: async iterator of rows
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    quotechar = fmtparams.get('quotechar', '"')
+    tail = ''
+    async for chunk in chunks:
+        text = tail + decoder.decode(chunk)
+        end = get_records_end(text, quotechar)
+        tail = text[end:]
+        if end:
+            for row in csv.reader(io.StringIO(text[:end]), **fmtparams):
+                yield row
+    tail += decoder.decode(b'', final=True)
+    if tail:
+        for row in csv.reader(io.StringIO(tail), **fmtparams):
+            yield row
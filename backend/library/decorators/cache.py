@@ -1,22 +1,37 @@
 import asyncio
 import inspect
 import threading
-from collections import defaultdict
 from functools import partial, update_wrapper
 
 from backend.library.decorators.base import decorator_with_defaults
 from backend.library.func import MultiFuncBase, args_to_dict
 from backend.library.cache import TemporaryDict
-from backend.library.coro import start_coro
 
 
-def _args_to_dict(args, kwargs, func_args, key_args):
-    cur_args = args_to_dict(args, kwargs, func_args)
-    return {arg_name: cur_args[arg_name] for arg_name in key_args if arg_name in cur_args}
+_MISSING = object()
 
 
-def _args_to_key(args, kwargs, func_args, key_args) -> frozenset:
-    return frozenset(_args_to_dict(args, kwargs, func_args, key_args).items())
+def _make_args_to_key(func_args, key_args):
+    """
+    Makes function that builds hashable key for result from args and kwargs of a call
+    :param func_args: names of positional args of function
+    :param key_args: names of args that form key
+    :return: function (args, kwargs) -> tuple
+    """
+    positions = tuple((i, name) for i, name in enumerate(func_args) if name in key_args)
+    kw_names = tuple(sorted(set(key_args) - set(func_args)))
+    n_prefix = len(positions) if all(i == pos[0] for i, pos in enumerate(positions)) and not kw_names else None
+
+    def args_to_key(args, kwargs):
+        if n_prefix is not None and not kwargs and len(args) >= n_prefix:
+            return args[:n_prefix]
+        n_args = len(args)
+        key = tuple(args[i] if i < n_args else kwargs.get(name, _MISSING) for i, name in positions)
+        if kw_names:
+            key += tuple(kwargs.get(name, _MISSING) for name in kw_names)
+        return key
+
+    return args_to_key
 
 
 @decorator_with_defaults
@@ -33,10 +48,11 @@ class unified:
         notifier: MultiFuncBase = None,
     ):
         """
-        Decorator for providing cached results
+        Decorator for providing cached results. Concurrent calls with same input are coalesced, so that func is
+        running only once for them. If the running call fails or is cancelled, waiting calls run func themselves
 
         :param func: function that should be decorated (doesn't matter async or not)
-        :param sem_value: number one time concurrent running functions for same input
+        :param sem_value: not used, left for compatibility
         :param depends_on: list of args names that form key for result
         :param ignore_args: list of args names that don't form key for result
         :param ttl: time to live for each result
@@ -56,15 +72,15 @@ class unified:
         self.func_args = inspect.getfullargspec(self.func).args
         key_args = set(depends_on or self.func_args) - set(ignore_args or ['cls'])
         is_async = asyncio.iscoroutinefunction(self.func)
-        sem_class = asyncio.Semaphore if is_async else threading.Semaphore
-        self.semaphores = defaultdict(lambda: sem_class(value=sem_value))
+        self._pending = {}
+        self._lock = threading.Lock()
         self.answers = self.make_answers_dict()
         self.base_name = based_on if based_on in self.func_args else None
         key_args.discard(self.base_name)
 
         self.answers_attr_name = f'__answers_for_{self.func.__name__}'
 
-        self.args_to_key = partial(_args_to_key, func_args=self.func_args, key_args=key_args)
+        self.args_to_key = _make_args_to_key(self.func_args, key_args)
 
         if notifier:
             notifier.add(self.delete_answers)
@@ -91,54 +107,84 @@ class unified:
 
     def delete_answers(self, *args, **kwargs):
         answers = self._get_answers(args, kwargs)
-        args_to_key = self.args_to_key(args, kwargs)
-        if not args_to_key:
+        key = self.args_to_key(args, kwargs)
+        if all(item is _MISSING for item in key):
             # without arguments clean all dict
-            self.answers = self.make_answers_dict()
-        else:
-            key = str(args_to_key)
-            if key in list(answers.keys()):
-                del answers[key]
+            answers.clear()
+        elif key in answers:
+            del answers[key]
 
     def get_answer(self, args, kwargs):
         answers = self._get_answers(args, kwargs)
-        key = str(self.args_to_key(args, kwargs))
-        return answers.get(key)
+        return answers.get(self.args_to_key(args, kwargs))
 
     def set_answer(self, args, kwargs, answer):
         answers = self._get_answers(args, kwargs)
-        key = str(self.args_to_key(args, kwargs))
-        answers[key] = answer
-
-    async def _release_semaphore(self, key: str):
-        if key in self.semaphores:
-            del self.semaphores[key]
+        answers[self.args_to_key(args, kwargs)] = answer
 
     def _sync_call(self, *args, **kwargs):
         answers = self._get_answers(args, kwargs)
-        key = str(self.args_to_key(args, kwargs))
-        with self.semaphores[key]:
-            if key not in answers:
-                answers[key] = self.func(*args, **kwargs)
-        start_coro(self._release_semaphore(key), 10)
-        return answers[key]
+        key = self.args_to_key(args, kwargs)
+        answer = answers.get(key, _MISSING)
+        if answer is not _MISSING:
+            return answer
+
+        pending_key = (id(answers), key)
+        with self._lock:
+            event = self._pending.get(pending_key)
+            if event is None:
+                self._pending[pending_key] = threading.Event()
+        if event is not None:
+            # same call is running in other thread
+            event.wait()
+            answer = answers.get(key, _MISSING)
+            return self._sync_call(*args, **kwargs) if answer is _MISSING else answer
+
+        try:
+            answer = self.func(*args, **kwargs)
+            answers[key] = answer
+            return answer
+        finally:
+            with self._lock:
+                event = self._pending.pop(pending_key)
+            event.set()
 
     async def _async_call(self, *args, **kwargs):
         answers = self._get_answers(args, kwargs)
-        key = str(self.args_to_key(args, kwargs))
-        async with self.semaphores[key]:
-            if key not in answers:
-                answers[key] = await self.func(*args, **kwargs)
-        start_coro(self._release_semaphore(key), 10)
-        return answers[key]
+        key = self.args_to_key(args, kwargs)
+        answer = answers.get(key, _MISSING)
+        if answer is not _MISSING:
+            return answer
+
+        pending_key = (id(answers), key)
+        while pending_key in self._pending:
+            future = self._pending[pending_key]
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # the call that was running failed or is cancelled, so try to run it here
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[pending_key] = future
+        try:
+            answer = await self.func(*args, **kwargs)
+        except BaseException:
+            # waiters are woken up by cancelling and run func themselves, as in _sync_call
+            future.cancel()
+            raise
+        else:
+            answers[key] = answer
+            future.set_result(answer)
+            return answer
+        finally:
+            del self._pending[pending_key]
 
     def __call__(self, *args, **kwargs):
         return self.__call__(*args, **kwargs)
 
     def __get__(self, instance, owner):
-        class BoundUnified:
-            __call__ = partial(self.__call__, instance)
-            _async_call = partial(self._async_call, instance)
-            _sync_call = partial(self._sync_call, instance)
-
-        return BoundUnified()
+        if instance is None:
+            return self
+        return partial(self.__call__, instance)
@@ -1,5 +1,5 @@
 from enum import auto, IntFlag
-from typing import Mapping, Callable, Any, List, Dict
+from typing import Mapping, Callable, Any, List, Dict, Optional
 import hashlib
 
 
@@ -27,6 +27,35 @@ class MultiFunc(MultiFuncBase):
         return {func: func(*args, **kwargs) for func in self._funcs}
 
 
+class BroadcastFunc(MultiFunc):
+    """
+    MultiFunc that is called in other processes too. Calls are sent by publisher, which is set when
+    broadcasting is started, and received calls are applied by BroadcastFunc.receive. Args should be JSON-serializable
+    """
+
+    registry: Dict[str, 'BroadcastFunc'] = {}
+    publisher: Optional[Callable[[str, tuple, dict], Any]] = None
+
+    def __init__(self, name: str, funcs=None):
+        super().__init__(funcs)
+        assert name not in self.registry, f'{self.__class__.__name__} "{name}" already exists'
+        self.name = name
+        self.registry[name] = self
+
+    def __call__(self, *args, **kwargs):
+        result = super().__call__(*args, **kwargs)
+        if BroadcastFunc.publisher is not None:
+            BroadcastFunc.publisher(self.name, args, kwargs)
+        return result
+
+    @classmethod
+    def receive(cls, name: str, args, kwargs):
+        """Calls functions of BroadcastFunc by name without publishing the call again"""
+        func = cls.registry.get(name)
+        if func is not None:
+            return MultiFunc.__call__(func, *args, **kwargs)
+
+
 class MultiFuncAsync(MultiFuncBase):
     async def __call__(self, *args, **kwargs):
         return {func: await func(*args, **kwargs) for func in self._funcs}
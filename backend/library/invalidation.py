@@ -0,0 +1,66 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Optional
+
+from backend.config import REDIS_INVALIDATION_CHANNEL
+from backend.library.coro import start_coro
+from backend.library.func import BroadcastFunc
+from backend.library.redis import publish, get_channel, redis_manager
+
+
+logger = logging.getLogger(__name__)
+ORIGIN = uuid.uuid4().hex  # id of current worker, its own messages are skipped
+_listener: Optional[asyncio.Task] = None
+
+
+def publish_call(name: str, args, kwargs):
+    message = json.dumps({'origin': ORIGIN, 'name': name, 'args': args, 'kwargs': kwargs})
+    start_coro(publish(message, REDIS_INVALIDATION_CHANNEL))
+
+
+def apply_message(data):
+    message = json.loads(data)
+    if message['origin'] != ORIGIN:
+        BroadcastFunc.receive(message['name'], message['args'], message['kwargs'])
+
+
+async def listen(channel: str = REDIS_INVALIDATION_CHANNEL, reconnect_after: float = 1):
+    """Applies calls of BroadcastFunc from other workers, reconnects if connection is lost"""
+    while True:
+        pubsub = None
+        try:
+            pubsub = await get_channel(channel)
+            async for message in pubsub.listen():
+                if message['type'] == 'message':
+                    try:
+                        apply_message(message['data'])
+                    except Exception:
+                        logger.exception('Invalidation message is not applied')
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Invalidation channel is lost')
+        finally:
+            if pubsub is not None:
+                await asyncio.shield(redis_manager.unsubscribe(pubsub))
+        await asyncio.sleep(reconnect_after)
+
+
+def start_invalidation():
+    """Starts publishing calls of BroadcastFunc and listening to calls from other workers"""
+    global _listener
+    BroadcastFunc.publisher = publish_call
+    if _listener is None or _listener.done():
+        _listener = start_coro(listen())
+    return _listener
+
+
+async def stop_invalidation():
+    global _listener
+    BroadcastFunc.publisher = None
+    if _listener is not None:
+        _listener.cancel()
+        await asyncio.gather(_listener, return_exceptions=True)
+        _listener = None
@@ -1,18 +1,86 @@
+import atexit
+import copy
+import json
 import logging
-from os.path import join, isfile
-from typing import Optional
+import queue
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from os import getpid
+from os.path import join, splitext
+from typing import List, Optional, Tuple, Union
 
-from backend.config import DATA_DIR, ArgParse
-from backend.library.func import new_file
+from backend.config import DATA_DIR, LOG_NAME, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_JSON, SERVER_WORKERS
+
+# attributes of every LogRecord, other attributes are passed by extra and written to JSON as is
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+_exc_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as JSON lines with time, level, logger, message, exception and fields passed by extra"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exception'] = record.exc_text
+        data.update({key: value for key, value in vars(record).items() if key not in RECORD_ATTRS})
+        return json.dumps(data, default=str, ensure_ascii=False)
+
+
+class LightQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting to the writer thread. Only the message and the traceback are rendered in
+    the caller, so that records can be pickled and args are not changed after the call
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
 
 class MainLogger:
+    """
+    Logger that writes to a rotated file in DATA_DIR. Records are put to a queue and written by a background thread,
+    so a log call in the event loop doesn't wait for disk
+    """
+
     _main_logger: Optional[logging.Logger] = None
+    _listeners: List[Tuple[logging.Logger, QueueHandler, QueueListener]] = []
 
-    def __init__(self, name: str, filename: str = None):
+    def __init__(
+        self,
+        name: str,
+        filename: str = None,
+        max_bytes: int = LOG_MAX_BYTES,
+        backup_count: int = LOG_BACKUP_COUNT,
+        json_lines: bool = LOG_JSON,
+        per_process: bool = SERVER_WORKERS > 1,
+    ):
+        """
+        :param max_bytes: size of the file after which it's rotated, 0 to never rotate
+        :param backup_count: number of rotated files to keep
+        :param json_lines: write records as JSON lines
+        :param per_process: add pid to the name of the file, rotation of a file shared by processes loses records
+        """
         self._logger: Optional[logging.Logger] = None
         self._name = name
         self._log_filename = filename if filename else f'log_{name}.log'
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.json_lines = json_lines
+        self.per_process = per_process
 
     @property
     def logger(self):
@@ -20,29 +88,56 @@ class MainLogger:
 
     @property
     def log_path(self):
-        return join(DATA_DIR, self._log_filename)
+        filename = self._log_filename
+        if self.per_process:
+            root, ext = splitext(filename)
+            filename = f'{root}_{getpid()}{ext}'
+        return join(DATA_DIR, filename)
 
-    def init_logger(self):
-        path = self.log_path
-        if not isfile(path):
-            new_file(path)
-        self._logger = self.get_logger()
+    def init_logger(self, level: Union[int, str] = logging.INFO):
+        self._logger = self.get_logger(level)
         return self._logger
 
-    def get_logger(self, level: int = logging.INFO) -> logging.Logger:
+    def get_file_handler(self) -> logging.Handler:
+        handler = RotatingFileHandler(
+            self.log_path, maxBytes=self.max_bytes, backupCount=self.backup_count, encoding='utf-8'
+        )
+        if self.json_lines:
+            handler.setFormatter(JsonFormatter())
+        else:
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        return handler
+
+    def get_logger(self, level: Union[int, str] = logging.INFO) -> logging.Logger:
         __logger = logging.getLogger(self._name)
         __logger.setLevel(level)
-        if not len(__logger.handlers):
-            __handler = logging.FileHandler(self.log_path)
-            # __handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s'))
-            __logger.addHandler(__handler)
+        if not any(isinstance(handler, QueueHandler) for handler in __logger.handlers):
+            records = queue.SimpleQueue()
+            listener = QueueListener(records, self.get_file_handler(), respect_handler_level=True)
+            listener.start()
+            handler = LightQueueHandler(records)
+            __logger.addHandler(handler)
+            self._listeners.append((__logger, handler, listener))
         return __logger
 
     @classmethod
-    def update_main_logger(cls):
-        cls._main_logger = MainLogger(ArgParse.getter('srv_name')).init_logger()
+    def stop_listeners(cls):
+        """Writes queued records and stops writer threads, should be called on shutdown"""
+        while cls._listeners:
+            logger, queue_handler, listener = cls._listeners.pop()
+            logger.removeHandler(queue_handler)
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+
+    @classmethod
+    def update_main_logger(cls, name: str = LOG_NAME, level: Union[int, str] = LOG_LEVEL):
+        cls._main_logger = MainLogger(name).init_logger(level)
         return cls._main_logger
 
     @classmethod
     def main_logger(cls):
         return cls._main_logger
+
+
+atexit.register(MainLogger.stop_listeners)
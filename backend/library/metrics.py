@@ -0,0 +1,191 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import perf_counter
+from typing import Callable, Dict, Iterable, Optional
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+stats_sources: Dict[str, Callable[[], dict]] = {}  # name: function that returns stats, shown by admin stats
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('timings', default=None)
+
+
+def register_stats(name: str, func: Callable[[], dict]):
+    stats_sources[name] = func
+
+
+def get_stats() -> dict:
+    return {name: func() for name, func in stats_sources.items()}
+
+
+class Histogram:
+    """Histogram with fixed buckets, values are counted like in prometheus: value <= bucket"""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        :return: list of (bucket, number of values <= bucket), last bucket is inf
+        """
+        result = []
+        total = 0
+        for bucket, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            result.append((bucket, total))
+        return result
+
+    def as_dict(self) -> dict:
+        return {
+            'buckets': {str(bucket): n for bucket, n in self.cumulative()},
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+
+def start_timings() -> tuple:
+    """
+    Starts collecting time of components (db, redis, ...) for the current request
+    :return: dict of component: seconds, that is filled by timed functions, and token to stop collecting
+    """
+    timings = {}
+    return timings, _timings.set(timings)
+
+
+def stop_timings(token):
+    _timings.reset(token)
+
+
+def add_time(component: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[component] = timings.get(component, 0.0) + seconds
+
+
+@contextmanager
+def timer(component: str):
+    """Adds time of the block to component of the current request"""
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        add_time(component, perf_counter() - started)
+
+
+def timed(component: str):
+    """
+    Decorator that adds time of calls to component of the current request. Calls outside of requests are not measured
+    """
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                timings = _timings.get()
+                if timings is None:
+                    return await func(*args, **kwargs)
+                started = perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    timings[component] = timings.get(component, 0.0) + perf_counter() - started
+
+        else:
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                timings = _timings.get()
+                if timings is None:
+                    return func(*args, **kwargs)
+                started = perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    timings[component] = timings.get(component, 0.0) + perf_counter() - started
+
+        return wrapper
+
+    return decorator
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels: dict) -> str:
+    return ','.join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+
+
+def render_histogram(name: str, labels: dict, histogram: Histogram) -> list:
+    lines = []
+    for bucket, n in histogram.cumulative():
+        le = '+Inf' if bucket == float('inf') else repr(bucket)
+        lines.append(f'{name}_bucket{{{format_labels({**labels, "le": le})}}} {n}')
+    lines.append(f'{name}_sum{{{format_labels(labels)}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{format_labels(labels)}}} {histogram.count}')
+    return lines
+
+
+def flatten_stats(stats: dict, prefix: str = '') -> Iterable[tuple]:
+    """Yields (dotted key, value) for numeric values of nested stats"""
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            yield from flatten_stats(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)):
+            yield f'{prefix}{key}', float(value)
+
+
+class RequestMetrics:
+    """Histograms of request time per route and of time of components (db, redis, ...) inside requests"""
+
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.durations: Dict[tuple, Histogram] = {}  # (method, route): histogram
+        self.components: Dict[tuple, Histogram] = {}  # (method, route, component): histogram
+        self.responses: Dict[tuple, int] = defaultdict(int)  # (method, route, status): number
+
+    def observe(self, method: str, route: str, status: int, seconds: float, timings: Dict[str, float]):
+        key = (method, route)
+        histogram = self.durations.get(key)
+        if histogram is None:
+            histogram = self.durations[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        self.responses[(method, route, status)] += 1
+        for component, component_seconds in timings.items():
+            histogram = self.components.get((method, route, component))
+            if histogram is None:
+                histogram = self.components[(method, route, component)] = Histogram(self.buckets)
+            histogram.observe(component_seconds)
+
+    def render(self) -> str:
+        """Returns metrics and numeric values of stats_sources in Prometheus text format"""
+        lines = ['# TYPE http_request_duration_seconds histogram']
+        for (method, route), histogram in self.durations.items():
+            lines += render_histogram('http_request_duration_seconds', {'method': method, 'route': route}, histogram)
+        lines.append('# TYPE http_request_component_seconds histogram')
+        for (method, route, component), histogram in self.components.items():
+            labels = {'method': method, 'route': route, 'component': component}
+            lines += render_histogram('http_request_component_seconds', labels, histogram)
+        lines.append('# TYPE http_responses_total counter')
+        for (method, route, status), n in self.responses.items():
+            labels = {'method': method, 'route': route, 'status': status}
+            lines.append(f'http_responses_total{{{format_labels(labels)}}} {n}')
+        lines.append('# TYPE app_stats gauge')
+        for source, stats in get_stats().items():
+            for key, value in flatten_stats(stats):
+                lines.append(f'app_stats{{{format_labels({"source": source, "key": key})}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
@@ -1,42 +1,187 @@
 import asyncio
+import json
 import aioredis
 from functools import wraps
-from typing import Iterable, Union
+from typing import Dict, Iterable, Optional, Union
 
-from backend.library.decorators.cache import unified
 from backend.library.decorators.other import decorator_with_defaults
-from backend.library.coro import start_coro
+from backend.config import (
+    REDIS_URL,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_MAX_SUBSCRIPTIONS,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_SOCKET_CONNECT_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_COUNTER_FLUSH_INTERVAL,
+    REDIS_COUNTER_FLUSH_MAX,
+)
+from backend.library.coro import on_shutdown, start_coro
+from backend.library.metrics import register_stats, timed
+from backend.library.counter import CounterAggregator
 from backend.library.func import MultiFunc
 
-reset_redis_client = MultiFunc()
 
-
-@unified(notifier=reset_redis_client)
-async def get_aclient(db: int = 0):
-    return await get_new_aclient(db)
+class RedisManager:
+    """
+    Keeps pooled clients for commands (one per db) and a dedicated client for subscriptions, so that listening
+    doesn't take connections of the pool and is not broken by socket timeout. Each subscription holds a connection of
+    the dedicated client until it's unsubscribed
+    """
+
+    def __init__(
+        self,
+        url: str = REDIS_URL,
+        max_connections: int = REDIS_MAX_CONNECTIONS,
+        max_subscriptions: int = REDIS_MAX_SUBSCRIPTIONS,
+        socket_timeout: Optional[float] = REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout: Optional[float] = REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval: int = REDIS_HEALTH_CHECK_INTERVAL,
+    ):
+        self.url = url
+        self.max_connections = max_connections
+        self.max_subscriptions = max_subscriptions
+        self.socket_timeout = socket_timeout
+        self.socket_connect_timeout = socket_connect_timeout
+        self.health_check_interval = health_check_interval
+        self._clients: Dict[int, aioredis.Redis] = {}
+        self._pubsub_client: Optional[aioredis.Redis] = None
+        self._pubsubs = set()
+
+    def get_client(self, db: Optional[int] = None) -> aioredis.Redis:
+        client = self._clients.get(db)
+        if client is None:
+            pool = aioredis.ConnectionPool.from_url(
+                self.url,
+                max_connections=self.max_connections,
+                socket_timeout=self.socket_timeout,
+                socket_connect_timeout=self.socket_connect_timeout,
+                health_check_interval=self.health_check_interval,
+                **({} if db is None else {'db': db}),
+            )
+            client = self._clients[db] = aioredis.Redis(connection_pool=pool)
+        return client
+
+    async def subscribe(self, *channels):
+        """Subscribes to channels by a connection of the dedicated client"""
+        if self._pubsub_client is None:
+            self._pubsub_client = aioredis.from_url(
+                self.url,
+                max_connections=self.max_subscriptions,
+                socket_connect_timeout=self.socket_connect_timeout,
+                health_check_interval=self.health_check_interval,
+            )
+        pubsub = self._pubsub_client.pubsub()
+        await pubsub.subscribe(*channels)
+        self._pubsubs.add(pubsub)
+        return pubsub
+
+    async def unsubscribe(self, pubsub):
+        self._pubsubs.discard(pubsub)
+        await pubsub.close()
+
+    def reset(self):
+        """Forgets clients, they are closed in background"""
+        clients = list(self._clients.values()) + ([self._pubsub_client] if self._pubsub_client else [])
+        self._clients = {}
+        self._pubsub_client = None
+        self._pubsubs = set()
+        for client in clients:
+            start_coro(client.close())
+
+    async def close(self):
+        for pubsub in list(self._pubsubs):
+            await self.unsubscribe(pubsub)
+        clients = list(self._clients.values()) + ([self._pubsub_client] if self._pubsub_client else [])
+        self._clients = {}
+        self._pubsub_client = None
+        for client in clients:
+            await client.close()
+            await client.connection_pool.disconnect()
+
+    def stats(self) -> dict:
+        pools = {}
+        for db, client in self._clients.items():
+            pool = client.connection_pool
+            pools[str(db if db is not None else pool.connection_kwargs.get('db', 0))] = {
+                'max_connections': pool.max_connections,
+                'created': pool._created_connections,
+                'available': len(pool._available_connections),
+                'in_use': len(pool._in_use_connections),
+            }
+        return {'url': self.url, 'pools': pools, 'subscriptions': len(self._pubsubs)}
+
+
+redis_manager = RedisManager()
+reset_redis_client = MultiFunc([redis_manager.reset])
+
+
+async def get_aclient(db: Optional[int] = None):
+    return redis_manager.get_client(db)
 
 
 async def get_new_aclient(db: int = 0):
-    return await aioredis.from_url('redis://127.0.0.1', db=db)
+    """Makes client that is not managed, it should be closed by the caller"""
+    return aioredis.from_url(redis_manager.url, db=db)
 
 
+@timed('redis')
 async def redis_call(op_name, *args, **kwargs):
     return await getattr(await get_aclient(), op_name)(*args, **kwargs)
 
 
+async def get_json(key):
+    value = await redis_call('get', key)
+    return json.loads(value) if value is not None else None
+
+
+async def set_json(key, value, ttl: int = None):
+    await redis_call('set', key, json.dumps(value, default=str), ex=ttl)
+
+
+async def delete_key(key):
+    await redis_call('delete', key)
+
+
+@timed('redis')
+async def delete_pattern(pattern):
+    client = await get_aclient()
+    keys = [key async for key in client.scan_iter(match=pattern)]
+    if keys:
+        await client.delete(*keys)
+
+
 async def get_channel(name):
-    return (await (await get_new_aclient()).subscribe(name))[0]
+    return await redis_manager.subscribe(name)
 
 
+@timed('redis')
 async def incrby(key, n=1):
     if key:
         return await (await get_aclient()).incrby(key, n)
 
 
+@timed('redis')
+async def incrby_many(counts: Dict[str, int]):
+    """Increments many keys by one MULTI/EXEC"""
+    async with (await get_aclient()).pipeline(transaction=True) as pipe:
+        for key, n in counts.items():
+            pipe.incrby(key, n)
+        await pipe.execute()
+
+
 async def publish(message, channel):
     await (await get_aclient()).publish(channel, message)
 
 
+counter_aggregator = CounterAggregator(
+    incrby_many, interval=REDIS_COUNTER_FLUSH_INTERVAL, max_pending=REDIS_COUNTER_FLUSH_MAX
+)
+on_shutdown.add(counter_aggregator.close)
+on_shutdown.add(redis_manager.close)
+register_stats('redis', redis_manager.stats)
+register_stats('redis_counters', counter_aggregator.stats)
+
+
 def runs_counter(**kwargs):
     kwargs.update(func=lambda *args, **kws: None)
     return count_runs(**kwargs)
@@ -73,24 +218,21 @@ def count_runs(
     @wraps(func)
     def wrapper(*args, **kwargs):
         if by_args:
-            key_to_use = get_key_by_args(args, kwargs)
-            start_coro(incrby(key_to_use, n))
+            counter_aggregator.add(get_key_by_args(args, kwargs), n)
             return func(*args, **kwargs)
         else:
             res = func(*args, **kwargs)
-            key_to_use = get_key_by_result(res, args, kwargs)
-            start_coro(incrby(key_to_use, n))
+            counter_aggregator.add(get_key_by_result(res, args, kwargs), n)
             return res
 
     @wraps(func)
     async def awrapper(*args, **kwargs):
         if by_args:
-            key_to_use = get_key_by_args(args, kwargs)
-            return (await asyncio.gather(func(*args, **kwargs), incrby(key_to_use, n)))[0]
+            counter_aggregator.add(get_key_by_args(args, kwargs), n)
+            return await func(*args, **kwargs)
         else:
             res = await func(*args, **kwargs)
-            key_to_use = get_key_by_result(res, args, kwargs)
-            start_coro(incrby(key_to_use, n))
+            counter_aggregator.add(get_key_by_result(res, args, kwargs), n)
             return res
 
     return awrapper if is_async else wrapper
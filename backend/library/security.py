@@ -1,16 +1,40 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+import jwt
 from passlib.context import CryptContext
 
-from backend.models.user import UserInDB, User, TokenData
-from backend.config import SECRET_KEY, ALGORITHM
+from backend.models.user import UserInDB, User, TokenData, reset_user_cache
+from backend.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    HASH_EXECUTOR,
+    HASH_WORKERS,
+    HASH_MAX_CONCURRENT,
+    USER_CACHE_TTL,
+    USER_CACHE_MAX_N,
+    USER_CACHE_REDIS,
+)
+from backend.db.base import get_or_none
+from backend.library.coro import ExecutorPool, start_coro
+from backend.library.decorators.cache import unified
+from backend.library.metrics import timed
+from backend.library.tokens import get_token_verifier
+
+if USER_CACHE_REDIS:
+    from backend.library.redis import get_json, set_json, delete_key
 
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/login")
+token_verifier = get_token_verifier(SECRET_KEY, ALGORITHM)
+hash_pool = ExecutorPool(
+    ProcessPoolExecutor if HASH_EXECUTOR == 'process' else ThreadPoolExecutor,
+    max_workers=HASH_WORKERS,
+    max_concurrent=HASH_MAX_CONCURRENT,
+)
 
 
 def verify_password(plain_password, hashed_password):
@@ -21,15 +45,49 @@ def get_password_hash(password):
     return pwd_context.hash(password)
 
 
-def get_user(username: str):
-    return UserInDB.get(UserInDB.username == username)
+@timed('password_hash')
+async def verify_password_async(plain_password, hashed_password):
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
 
 
-def authenticate_user(username: str, password: str):
-    user = get_user(username)
+@timed('password_hash')
+async def get_password_hash_async(password):
+    return await hash_pool.run(get_password_hash, password)
+
+
+async def get_user(username: str, *fields):
+    """
+    :param fields: fields to select, all fields by default
+    """
+    return await get_or_none(UserInDB.select(*fields), UserInDB.username == username)
+
+
+def get_user_cache_key(username: str):
+    return f'user_{username}'
+
+
+@unified(ttl=timedelta(seconds=USER_CACHE_TTL), max_n=USER_CACHE_MAX_N, notifier=reset_user_cache)
+async def get_cached_user(username: str):
+    if USER_CACHE_REDIS:
+        user_dict = await get_json(get_user_cache_key(username))
+        if user_dict is not None:
+            user_dict['created'] = datetime.fromisoformat(user_dict['created'])
+            return UserInDB(**user_dict)
+    user = await get_user(username, *UserInDB.get_visible_fields())
+    if USER_CACHE_REDIS and user is not None:
+        await set_json(get_user_cache_key(username), user.to_dict(), ttl=USER_CACHE_TTL)
+    return user
+
+
+if USER_CACHE_REDIS:
+    reset_user_cache.add(lambda username: start_coro(delete_key(get_user_cache_key(username))))
+
+
+async def authenticate_user(username: str, password: str):
+    user = await get_user(username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
@@ -41,7 +99,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = token_verifier.encode(to_encode)
     return encoded_jwt
 
 
@@ -52,14 +110,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = token_verifier.verify(token)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
+    except jwt.InvalidTokenError:
         raise credentials_exception
-    user = get_user(username=token_data.username)
+    user = await get_cached_user(token_data.username)
     if user is None:
         raise credentials_exception
     return user
@@ -2,10 +2,10 @@ from abc import abstractmethod
 import psycopg2
 import peewee
 import peewee_async
-import peewee_asyncext
 from peewee_migrate import Router
 import testing.postgresql
 
+from backend.db.pool import InstrumentedPostgresqlExtDatabase
 from backend.library.tests.base import BaseTestCase
 
 
@@ -31,7 +31,7 @@ class InitDatabase:
         )
 
     def create_temp_peewee_db(self, temb_db):
-        peewee_db = peewee_asyncext.PostgresqlExtDatabase(**temb_db.dsn(), register_hstore=True)
+        peewee_db = InstrumentedPostgresqlExtDatabase(**temb_db.dsn(), register_hstore=True)
         self.db.initialize(peewee_db)
         self.manager.initialize(peewee_async.Manager(self.db.obj))
         MODELS = self.all_models(self.base_model)
@@ -0,0 +1,64 @@
+import hashlib
+from time import time
+from typing import Dict, Iterable, Tuple, Union
+import jwt
+
+from backend.config import TOKEN_CACHE_MAX_N
+from backend.library.cache import TemporaryDict
+from backend.library.metrics import register_stats
+
+
+class TokenVerifier:
+    """
+    Verifies JWT and keeps claims of verified tokens in TemporaryDict until their exp, so that a token that is used
+    by many requests is decoded and checked once. Tokens are keyed by their digest, not kept as is
+    """
+
+    def __init__(self, secret: str, algorithms: Iterable[str] = ('HS256',), max_n: int = TOKEN_CACHE_MAX_N):
+        """
+        :param secret: key for signature
+        :param algorithms: accepted algorithms of signature
+        :param max_n: maximum number of cached tokens, least recently used are evicted above it
+        """
+        self.secret = secret
+        self.algorithms = list(algorithms)
+        self.data = TemporaryDict(max_n=max_n)  # digest of token: claims
+
+    @staticmethod
+    def get_key(token: Union[str, bytes]) -> bytes:
+        return hashlib.blake2b(token.encode() if isinstance(token, str) else token, digest_size=16).digest()
+
+    def verify(self, token: Union[str, bytes]) -> dict:
+        """
+        Returns claims of token, they should not be changed
+        :raise jwt.InvalidTokenError: token is empty, invalid, expired or doesn't have exp
+        """
+        if not token:
+            raise jwt.InvalidTokenError('Token is empty')
+        key = self.get_key(token)
+        claims = self.data.get(key)
+        if claims is None:
+            claims = jwt.decode(token, self.secret, algorithms=self.algorithms, options={'require': ['exp']})
+            ttl = int(claims['exp']) - time()  # PyJWT compares int(exp) with now
+            if ttl > 0:
+                self.data.set(key, claims, ttl=ttl)
+        return claims
+
+    def encode(self, claims: dict) -> str:
+        return jwt.encode(claims, self.secret, algorithm=self.algorithms[0])
+
+    def stats(self) -> dict:
+        return self.data.stats()
+
+
+_verifiers: Dict[Tuple[str, str], TokenVerifier] = {}
+
+
+def get_token_verifier(secret: str, algorithm: str = 'HS256') -> TokenVerifier:
+    """Returns verifier shared by all users of the secret and algorithm"""
+    key = (secret, algorithm)
+    verifier = _verifiers.get(key)
+    if verifier is None:
+        verifier = _verifiers[key] = TokenVerifier(secret, [algorithm])
+        register_stats(f'token_cache_{len(_verifiers)}', verifier.stats)
+    return verifier
@@ -2,14 +2,17 @@ from peewee import TextField, BooleanField, FloatField
 from typing import Optional
 
 from backend.models.base import BaseItem
-from backend.db.base import BaseDBItem
+from backend.db.base import BaseDBItem, BaseDBCache
 from backend.db.fields import OptionsField
+from backend.library.func import BroadcastFunc
+
+reset_item_cache = BroadcastFunc('reset_item_cache')
 
 
 class ItemInDB(BaseDBItem):
     name = TextField(null=False)  # str
     price = FloatField(null=True)  # float
-    is_offer = BooleanField(default=False)  # Optional[bool]
+    is_offer = BooleanField(default=False, index=True)  # Optional[bool]
     status = OptionsField(
         [
             'new',
@@ -17,7 +20,9 @@ class ItemInDB(BaseDBItem):
             'vip',
         ],
         default='new',
+        index=True,
     )
+    notifier = reset_item_cache
 
     @property
     async def dict(self):
@@ -37,6 +42,16 @@ class ItemInDB(BaseDBItem):
 
     class Meta:
         table_name = 'items'
+        indexes = ((('created',), False),)
+
+
+class ItemCache(BaseDBCache):
+    _model = ItemInDB
+    indexed = ('status', 'is_offer')
+    range_indexed = ('price', 'created')
+
+
+reset_item_cache.add(ItemCache.invalidate)
 
 
 """
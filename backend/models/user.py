@@ -4,6 +4,9 @@ from peewee import TextField, BooleanField
 
 from backend.db.base import BaseDBItem
 from backend.models.base import BaseItem
+from backend.library.func import BroadcastFunc, FieldHidden
+
+reset_user_cache = BroadcastFunc('reset_user_cache')
 
 
 class Token(BaseModel):
@@ -36,9 +39,9 @@ class User(BaseItem):
 
 
 class UserInDB(BaseDBItem):
-    username = TextField(null=False)  # str
-    hashed_password = TextField(null=False)  # str
-    email = TextField(null=True)  # Optional[str] = None
+    username = TextField(null=False, unique=True)  # str
+    hashed_password = TextField(null=False, _hidden=FieldHidden.READ)  # str
+    email = TextField(null=True, index=True)  # Optional[str] = None
     full_name = TextField(null=True)  # Optional[str] = None
     role = TextField(null=True, default='restricted_user')
     disabled = BooleanField(default=False)  # Optional[bool] = None
@@ -53,9 +56,20 @@ class UserInDB(BaseDBItem):
             'full_name': self.full_name,
             'role': self.role,
             'disabled': self.disabled,
-            'hashed_password': self.hashed_password,
         }
 
+    @classmethod
+    async def update_or_create(cls, obj, obj_db=None, ret=None, return_obj_db=False):
+        usernames = {obj_db.username} if obj_db is not None else set()
+        ret, obj_db = await super().update_or_create(obj, obj_db, ret, return_obj_db=True)
+        usernames.add(obj_db.username)
+        for username in usernames:
+            reset_user_cache(username)
+        if return_obj_db:
+            return ret, obj_db
+        else:
+            return ret
+
     class Meta:
         table_name = 'users'
 
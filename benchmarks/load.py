@@ -0,0 +1,203 @@
+"""
+Latency and throughput of hot API endpoints under concurrent load
+
+Boots the app against a temporary database of testing.postgresql, seeds it with fake users and items and drives
+each endpoint with async httpx client. Prints JSON report with p50/p95/p99 latency in ms and req/s for each
+endpoint, so reports of different commits can be compared. Database mode (sync or async) is taken from config
+
+Run: python -m benchmarks.load [--requests 1000] [--concurrency 20] [--items 10000] [--output report.json]
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from os.path import join
+from typing import Awaitable, Callable, Dict, List
+
+import httpx
+
+from backend.api import app
+from backend.config import DEFAULT_WORK_DIR
+from backend.db.base import BaseDBModel, db, manager, DB_ASYNC
+from backend.library.security import get_password_hash
+from backend.library.tests.db import InitDatabase
+from backend.library.tests.utils import faker
+from backend.models.item import ItemInDB
+from backend.models.user import UserInDB
+
+
+PASSWORD = 'benchmark'
+SCENARIOS = ('login', 'items_list', 'item', 'item_new')
+
+
+def seed(users_n: int, items_n: int, batch_size: int = 1000) -> dict:
+    """Fills database with fake users and items, all users have PASSWORD"""
+    hashed_password = get_password_hash(PASSWORD)
+    usernames = [f'{faker.user_name()}_{i}' for i in range(users_n)]
+    UserInDB.insert_many(
+        [
+            {
+                'username': username,
+                'hashed_password': hashed_password,
+                'email': faker.email(),
+                'full_name': faker.name(),
+                'role': 'user',
+                'disabled': False,
+            }
+            for username in usernames
+        ]
+    ).execute()
+    statuses = list(ItemInDB.status.options)
+    for i in range(0, items_n, batch_size):
+        ItemInDB.insert_many(
+            [
+                {
+                    'name': faker.catch_phrase(),
+                    'price': round(random.uniform(1, 1000), 2),
+                    'is_offer': faker.boolean(),
+                    'status': random.choice(statuses),
+                }
+                for _ in range(min(batch_size, items_n - i))
+            ]
+        ).execute()
+    ids = [item_id for item_id, in ItemInDB.select(ItemInDB.id).tuples()]
+    return {'usernames': usernames, 'ids': ids}
+
+
+async def get_token(client: httpx.AsyncClient, username: str) -> str:
+    response = await client.post('/login', data={'username': username, 'password': PASSWORD})
+    response.raise_for_status()
+    data = response.json()
+    return data['token_type'] + ' ' + data['access_token']
+
+
+def get_requests(seeded: dict, headers: dict) -> Dict[str, Callable[[httpx.AsyncClient], Awaitable]]:
+    """Returns functions that send one request of each scenario"""
+    usernames, ids = seeded['usernames'], seeded['ids']
+    return {
+        'login': lambda client: client.post(
+            '/login', data={'username': random.choice(usernames), 'password': PASSWORD}
+        ),
+        'items_list': lambda client: client.get(
+            '/api/items/list', params={'after_id': random.choice(ids) - 1}, headers=headers
+        ),
+        'item': lambda client: client.get(f'/api/items/{random.choice(ids)}', headers=headers),
+        'item_new': lambda client: client.post(
+            '/api/items/new',
+            params={'name': faker.catch_phrase(), 'price': round(random.uniform(1, 1000), 2), 'status': 'new'},
+            headers=headers,
+        ),
+    }
+
+
+async def run_scenario(client: httpx.AsyncClient, send: Callable, requests_n: int, concurrency: int) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    left = requests_n
+
+    async def worker():
+        nonlocal errors, left
+        while left > 0:
+            left -= 1
+            start = time.perf_counter()
+            try:
+                response = await send(client)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - start
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'rps': round(len(latencies) / seconds, 1),
+        **get_percentiles(latencies),
+    }
+
+
+def get_percentiles(latencies: List[float], percents=(50, 95, 99)) -> dict:
+    """Returns percentiles of latencies in ms by nearest rank"""
+    values = sorted(latencies)
+    if not values:
+        return {f'p{percent}': None for percent in percents}
+    return {
+        f'p{percent}': round(values[max(0, -(-len(values) * percent // 100) - 1)] * 1000, 3) for percent in percents
+    }
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=DEFAULT_WORK_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+async def run(args, seeded: dict) -> dict:
+    await app.router.startup()
+    try:
+        async with httpx.AsyncClient(app=app, base_url='http://benchmark') as client:
+            headers = {'Authorization': await get_token(client, seeded['usernames'][0])}
+            requests = get_requests(seeded, headers)
+            results = {}
+            for name in args.scenarios:
+                requests_n = args.login_requests if name == 'login' else args.requests
+                await run_scenario(client, requests[name], min(requests_n, args.warmup), args.concurrency)
+                results[name] = await run_scenario(client, requests[name], requests_n, args.concurrency)
+            return results
+    finally:
+        await app.router.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--requests', type=int, default=1000, help='requests for each scenario')
+    parser.add_argument('--login-requests', type=int, default=100, help='requests for login, it hashes passwords')
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=50, help='requests before measuring')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file for JSON report, stdout by default')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    faker.seed_instance(args.seed)
+    init_db = InitDatabase(BaseDBModel, db, manager, join(DEFAULT_WORK_DIR, 'migrations'))
+    temp_db = init_db.dbFactory()
+    try:
+        init_db.create_temp_peewee_db(temp_db)
+        seeded = seed(args.users, args.items)
+        results = asyncio.run(run(args, seeded))
+    finally:
+        if not db.is_closed():
+            db.close()
+        temp_db.stop()
+        init_db.dbFactory.clear_cache()
+
+    report = {
+        'commit': get_commit(),
+        'python': sys.version.split()[0],
+        'db_async': DB_ASYNC,
+        'params': {
+            key: getattr(args, key) for key in ('requests', 'login_requests', 'concurrency', 'users', 'items', 'seed')
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Time and memory per operation of library primitives that are called on request paths
+
+Each benchmark reports ns/op (the best of repeats) and bytes allocated by one op, measured by tracemalloc as the peak
+of traced memory during a call. Results are compared with a saved baseline, the script fails if any benchmark is
+slower or allocates more than threshold allows. count_runs is measured with fakeredis instead of Redis, it's skipped
+if fakeredis or aioredis can't be imported
+
+Run: python -m benchmarks.micro [--save-baseline] [--baseline path] [--threshold 0.25] [--only name ...]
+"""
+import argparse
+import asyncio
+import json
+import math
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from os import makedirs
+from os.path import join, exists, dirname
+from typing import Callable, Dict, Optional
+
+from backend.config import DATA_DIR
+from backend.library.cache import TemporaryDict
+from backend.library.coro import maybe_coro
+from backend.library.decorators.cache import unified
+from backend.library.func import args_to_dict
+from backend.models.item import ItemInDB, ItemCache
+from benchmarks.unified import ns_per_call, await_n
+
+
+N = 100000
+ALLOC_N = 100
+DEFAULT_BASELINE = join(DATA_DIR, 'micro_baseline.json')
+
+
+def reset_peak():
+    """tracemalloc.reset_peak appeared in python 3.9, before it tracing is restarted, which also resets the peak"""
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.stop()
+        tracemalloc.start()
+
+
+def peak_bytes_per_op(op: Callable, number: int = ALLOC_N) -> int:
+    """Returns the largest peak of memory allocated by one call of op"""
+    op()
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(number):
+            reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            op()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def measure(op: Callable, number: int = N) -> dict:
+    return {'ns_per_op': round(ns_per_call(op, number=number), 1), 'bytes_per_op': peak_bytes_per_op(op)}
+
+
+async def measure_coro(func, *args, number: int = N, **kwargs) -> dict:
+    """Measures awaiting func in the running loop"""
+    loop = asyncio.get_running_loop()
+    best = math.inf
+    for _ in range(5):
+        start = loop.time()
+        await await_n(func, number, *args, **kwargs)
+        best = min(best, loop.time() - start)
+    peak = 0
+    tracemalloc.start()
+    try:
+        for _ in range(ALLOC_N):
+            reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            await func(*args, **kwargs)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - start)
+    finally:
+        tracemalloc.stop()
+    return {'ns_per_op': round(best / number * 1e9, 1), 'bytes_per_op': peak}
+
+
+def measure_async(func, *args, number: int = N, **kwargs) -> dict:
+    return asyncio.run(measure_coro(func, *args, number=number, **kwargs))
+
+
+def bench_temporary_dict() -> Dict[str, dict]:
+    data = TemporaryDict(max_n=1000)
+    for i in range(1000):
+        data[i] = i
+    i = iter(range(10**9))
+    return {
+        'TemporaryDict get (hit)': measure(lambda: data.get(500)),
+        'TemporaryDict get (miss)': measure(lambda: data.get(-1)),
+        'TemporaryDict set (evict)': measure(lambda: data.__setitem__(next(i), 0)),
+    }
+
+
+def bench_unified() -> Dict[str, dict]:
+    @unified
+    def cached(a, b=0):
+        return a + b
+
+    @unified(ttl=timedelta(hours=1))
+    async def acached(a, b=0):
+        return a + b
+
+    return {
+        'unified hit (args)': measure(lambda: cached(1, 2)),
+        'unified hit (kwargs)': measure(lambda: cached(1, b=2)),
+        'unified async hit (ttl)': measure_async(acached, 1, 2),
+    }
+
+
+def bench_options_field() -> Dict[str, dict]:
+    field = ItemInDB.status
+    labels = ['new', 'old', 'vip'] * 1000
+    return {
+        'OptionsField.db_value': measure(lambda: field.db_value('vip')),
+        'OptionsField.python_value': measure(lambda: field.python_value(2)),
+        'OptionsField.db_values (3000)': measure(lambda: field.db_values(labels), number=N // 100),
+    }
+
+
+def bench_maybe_coro() -> Dict[str, dict]:
+    def plain(a, b=0):
+        return a + b
+
+    async def aplain(a, b=0):
+        return a + b
+
+    return {
+        'maybe_coro (sync func)': measure_async(maybe_coro, plain, 1, 2),
+        'maybe_coro (async func)': measure_async(maybe_coro, aplain, 1, 2),
+    }
+
+
+def bench_args_to_dict() -> Dict[str, dict]:
+    func_args = ['a', 'b', 'c', 'd']
+    args, kwargs = (1, 2), {'c': 3, 'd': 4}
+    return {'args_to_dict': measure(lambda: args_to_dict(args, kwargs, func_args))}
+
+
+def bench_count_runs() -> Optional[Dict[str, dict]]:
+    try:
+        import fakeredis.aioredis
+        from backend.library import redis
+    except (ImportError, TypeError) as e:  # aioredis 2.0.1 raises TypeError on import in Python 3.11+
+        print(f'count_runs is skipped: {e!r}', file=sys.stderr)
+        return None
+
+    async def run():
+        redis.redis_manager._clients[None] = fakeredis.aioredis.FakeRedis()
+
+        @redis.count_runs
+        async def counted(a, b=0):
+            return a + b
+
+        results = {'count_runs (async)': await measure_coro(counted, 1, 2)}
+        await redis.counter_aggregator.close()
+        sent = await redis.redis_call('get', 'n_counted_runs')
+        await redis.redis_manager.close()
+        return results, int(sent or 0)
+
+    results, sent = asyncio.run(run())
+    if not sent:
+        raise RuntimeError('count_runs sent nothing to Redis')
+    return results
+
+
+def bench_cache_filter(n: int = 10000) -> Dict[str, dict]:
+    ItemCache.clear()
+    statuses = list(ItemInDB.status.options)
+    created = datetime(2020, 1, 1)
+
+    async def fill():
+        for i in range(1, n + 1):
+            obj = ItemInDB(
+                id=i,
+                name=f'item {i}',
+                price=float(i % 1000),
+                is_offer=bool(i % 2),
+                status=statuses[i % len(statuses)],
+                created=created + timedelta(minutes=i),
+            )
+            await ItemCache._add(obj, keep_sorted=False)
+        for index in ItemCache._sorted_index.values():
+            index.sort()
+
+    asyncio.run(fill())
+    try:
+        return {
+            f'BaseDBCache.filter hash ({n})': measure(lambda: ItemCache.filter(status='vip', is_offer=True), N // 100),
+            f'BaseDBCache.filter range ({n})': measure(lambda: ItemCache.filter(price__gte=990), N // 100),
+            f'BaseDBCache.filter scan ({n})': measure(lambda: ItemCache.filter(name='item 5'), N // 1000),
+        }
+    finally:
+        ItemCache.clear()
+
+
+BENCHMARKS = {
+    'temporary_dict': bench_temporary_dict,
+    'unified': bench_unified,
+    'options_field': bench_options_field,
+    'maybe_coro': bench_maybe_coro,
+    'args_to_dict': bench_args_to_dict,
+    'count_runs': bench_count_runs,
+    'cache_filter': bench_cache_filter,
+}
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns descriptions of results that are worse than baseline by more than threshold (0.25 is 25%)"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in ('ns_per_op', 'bytes_per_op'):
+            value, base_value = result.get(metric), base.get(metric)
+            if value is None or not base_value:
+                continue
+            if value > base_value * (1 + threshold):
+                regressions.append(f'{name}: {metric} {base_value} -> {value} (+{value / base_value - 1:.0%})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help='benchmarks to run, all by default')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON file with baseline results')
+    parser.add_argument('--save-baseline', action='store_true', help='save results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed relative regression')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        results.update(BENCHMARKS[name]() or {})
+    for name, result in results.items():
+        print(f'{name:34} {result["ns_per_op"]:12.1f} ns/op {result["bytes_per_op"]:8} B/op')
+
+    if args.save_baseline:
+        baseline = {}
+        if exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        makedirs(dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'Baseline is saved to {args.baseline}')
+    elif exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print('Regressions:', *regressions, sep='\n')
+            sys.exit(1)
+        print(f'No regressions above {args.threshold:.0%}')
+    else:
+        print(f'There is no baseline {args.baseline}, run with --save-baseline')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Per-call overhead of a cache hit of unified decorator
+
+Run: python -m benchmarks.unified
+"""
+import asyncio
+import timeit
+
+from backend.library.decorators.cache import unified
+
+
+N = 200000
+
+
+def plain(a, b=0):
+    return a + b
+
+
+@unified
+def cached(a, b=0):
+    return a + b
+
+
+async def aplain(a, b=0):
+    return a + b
+
+
+@unified
+async def acached(a, b=0):
+    return a + b
+
+
+def ns_per_call(stmt, number=N) -> float:
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+
+async def await_n(func, number=N, *args, **kwargs):
+    for _ in range(number):
+        await func(*args, **kwargs)
+
+
+def async_ns_per_call(func, *args, number=N, **kwargs) -> float:
+    return ns_per_call(lambda: asyncio.run(await_n(func, number, *args, **kwargs)), number=1) / number
+
+
+def main():
+    results = {
+        'sync plain': ns_per_call(lambda: plain(1, 2)),
+        'sync hit (args)': ns_per_call(lambda: cached(1, 2)),
+        'sync hit (kwargs)': ns_per_call(lambda: cached(1, b=2)),
+        'async plain': async_ns_per_call(aplain, 1, 2),
+        'async hit (args)': async_ns_per_call(acached, 1, 2),
+        'async hit (kwargs)': async_ns_per_call(acached, 1, b=2),
+    }
+    for name, value in results.items():
+        print(f'{name:20} {value:10.1f} ns/call')
+
+
+if __name__ == "__main__":
+    main()
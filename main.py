@@ -1,7 +1,26 @@
 import uvicorn
-from backend.config import DB_SETTINGS
+from backend.config import (
+    DB_SETTINGS,
+    SERVER_WORKERS,
+    SERVER_LOOP,
+    SERVER_HTTP,
+    SERVER_BACKLOG,
+    SERVER_KEEP_ALIVE,
+    SERVER_LIMIT_CONCURRENCY,
+)
 from backend.api import *
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host=DB_SETTINGS['DOMAIN'], port=DB_SETTINGS['PORT'])
+    # app is passed as import string, so that each worker imports it and initializes DB and redis by itself
+    uvicorn.run(
+        "main:app",
+        host=DB_SETTINGS['DOMAIN'],
+        port=DB_SETTINGS['PORT'],
+        workers=SERVER_WORKERS,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        backlog=SERVER_BACKLOG,
+        timeout_keep_alive=SERVER_KEEP_ALIVE,
+        limit_concurrency=SERVER_LIMIT_CONCURRENCY,
+    )
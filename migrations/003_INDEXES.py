@@ -0,0 +1,20 @@
+"""Peewee migrations -- 003_INDEXES.py.
+
+Indexes for lookups of users by username (unique) and email and for filters and ordering of items
+"""
+
+
+def migrate(migrator, database, fake=False, **kwargs):
+    migrator.add_index('users', 'username', unique=True)
+    migrator.add_index('users', 'email', unique=False)
+    migrator.add_index('items', 'status', unique=False)
+    migrator.add_index('items', 'is_offer', unique=False)
+    migrator.add_index('items', 'created', unique=False)
+
+
+def rollback(migrator, database, fake=False, **kwargs):
+    migrator.drop_index('users', 'username')
+    migrator.drop_index('users', 'email')
+    migrator.drop_index('items', 'status')
+    migrator.drop_index('items', 'is_offer')
+    migrator.drop_index('items', 'created')
@@ -0,0 +1,60 @@
+import pytest
+
+from backend.db.fields import OptionsField
+from backend.db.indexes import format_indexes, get_model_indexes, migrate_indexes
+from backend.models.item import ItemInDB
+from backend.models.user import UserInDB
+
+
+class TestOptionsField:
+    def test_values(self):
+        field = OptionsField(['new', 'old', 'vip'])
+        assert field.db_value('vip') == 2
+        assert field.db_value(1) == 1
+        assert field.db_value(None) is None
+        assert field.python_value(2) == 'vip'
+        assert field.python_value('old') == 'old'
+        with pytest.raises(ValueError):
+            field.python_value(5)
+        with pytest.raises(ValueError):
+            field.db_value('unknown')
+        with pytest.raises(ValueError):
+            field.db_value(['new'])
+
+    def test_bulk_values(self):
+        field = OptionsField({10: 'a', 20: 'b'})
+        assert field.db_values(['a', 'b', None, 20]) == [10, 20, None, 20]
+        assert field.python_values([20, 10, None, 'a']) == ['b', 'a', None, 'a']
+        with pytest.raises(ValueError, match='30'):
+            field.python_values([10, 30])
+        with pytest.raises(ValueError, match='"c"'):
+            field.db_values(['a', 'c'])
+
+    def test_serializer(self):
+        names = [field.name for field in ItemInDB.get_visible_fields()]
+        row = tuple(2 if name == 'status' else name for name in names)
+        assert ItemInDB.get_serializer()([row]) == [{**dict(zip(names, names)), 'status': 'vip'}]
+        assert ItemInDB.get_serializer()([]) == []
+
+
+class TestIndexes:
+    class Migrator:
+        def __init__(self):
+            self.indexes = []
+
+        def add_index(self, model, *columns, unique=False):
+            self.indexes.append((model, columns, unique))
+
+    def test_model_indexes(self):
+        assert set(get_model_indexes(UserInDB)) == {(('username',), True), (('email',), False)}
+        assert set(get_model_indexes(ItemInDB)) == {(('status',), False), (('is_offer',), False), (('created',), False)}
+
+    def test_migrate_indexes(self):
+        migrator = self.Migrator()
+        migrate_indexes(migrator, UserInDB, 'username')
+        assert migrator.indexes == [('users', ('username',), True)]
+        with pytest.raises(AssertionError):
+            migrate_indexes(migrator, UserInDB, 'full_name')
+        assert format_indexes(UserInDB) == (
+            "migrator.add_index('users', 'username', unique=True)\nmigrator.add_index('users', 'email', unique=False)"
+        )
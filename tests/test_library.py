@@ -0,0 +1,320 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from unittest import mock
+
+import jwt
+import pytest
+
+from backend.library.cache import TemporaryDict, close_sweepers
+from backend.library.counter import CounterAggregator
+from backend.library.csv_stream import iter_csv_rows
+from backend.library.decorators.cache import unified
+from backend.library.func import MultiFunc, BroadcastFunc
+from backend.library.logger import MainLogger
+from backend.library.tokens import TokenVerifier
+
+
+class TestTemporaryDict:
+    def test_lru(self):
+        data = TemporaryDict(max_n=2)
+        data['a'] = 1
+        data['b'] = 2
+        assert data['a'] == 1
+        data['c'] = 3
+        assert 'b' not in data
+        assert list(data) == ['a', 'c']
+        assert data.get('b') is None
+        assert data.stats()['hits'] == 1
+        assert data.stats()['misses'] == 1
+        assert data.stats()['evictions'] == 1
+
+    def test_ttl(self):
+        data = TemporaryDict(ttl=0.05)
+        data[1] = 'a'
+        data.set(2, 'b', ttl=10)
+        assert data[1] == 'a'
+        time.sleep(0.1)
+        assert data.items() == [(2, 'b')]
+        assert data.values() == ['b']
+        assert 1 not in data
+        assert data[2] == 'b'
+        assert data.stats()['expirations'] == 1
+
+    def test_heap_size(self):
+        data = TemporaryDict(ttl=3600, max_n=10)
+        for i in range(100000):
+            data[i % 5] = i
+        assert len(data) == 5
+        assert len(data._heap) <= 20
+        assert data.values() == [99995, 99996, 99997, 99998, 99999]
+
+    def test_sweeper(self):
+        async def run():
+            data = TemporaryDict(ttl=0.05)
+            for i in range(100):
+                data[i] = i
+            data.set('short', 0, ttl=0.01)
+            await asyncio.sleep(0.02)
+            assert len(data) == 100
+            await asyncio.sleep(0.1)
+            assert len(data) == 0
+            assert data.stats()['expirations'] == 101
+
+        asyncio.run(run())
+
+    def test_close(self):
+        async def run():
+            data = TemporaryDict(ttl=10)
+            data[1] = 'a'
+            sweeper = data._sweeper
+            assert not sweeper.done()
+            await close_sweepers()
+            assert sweeper.cancelled()
+            assert data[1] == 'a'
+            data[2] = 'b'
+            sweeper = data._sweeper
+            assert not sweeper.done()
+            await data.close()
+            assert sweeper.cancelled()
+            assert data._sweeper is None
+
+        asyncio.run(run())
+
+
+class TestUnified:
+    def test_sync(self):
+        calls = []
+
+        @unified
+        def func(a, b=0):
+            calls.append((a, b))
+            return a + b
+
+        assert func(1, 2) == 3
+        assert func(1, b=2) == 3
+        assert func(a=1, b=2) == 3
+        assert calls == [(1, 2)]
+        func.delete_answers(1, 2)
+        assert func(1, 2) == 3
+        assert len(calls) == 2
+
+    def test_single_flight(self):
+        calls = []
+
+        @unified
+        async def func(a):
+            calls.append(a)
+            await asyncio.sleep(0.01)
+            return a * 2
+
+        async def run():
+            results = await asyncio.gather(*[func(i % 2) for i in range(10)])
+            assert results == [i % 2 * 2 for i in range(10)]
+            assert sorted(calls) == [0, 1]
+            assert await func(1) == 2
+            assert len(calls) == 2
+
+        asyncio.run(run())
+
+    def test_single_flight_failure(self):
+        calls = []
+
+        @unified
+        async def func(a):
+            calls.append(a)
+            await asyncio.sleep(0.01)
+            if len(calls) == 1:
+                raise ValueError(a)
+            return a * 2
+
+        async def run():
+            return await asyncio.gather(*[func(1) for _ in range(5)], return_exceptions=True)
+
+        results = asyncio.run(run())
+        assert isinstance(results[0], ValueError)
+        assert results[1:] == [2] * 4
+        assert calls == [1, 1]
+
+    def test_notifier(self):
+        notifier = MultiFunc()
+        calls = []
+
+        @unified(notifier=notifier, ttl=10)
+        async def func(a):
+            calls.append(a)
+            return a
+
+        async def run():
+            await func(1)
+            await func(2)
+            notifier(1)
+            await func(1)
+            await func(2)
+            assert calls == [1, 2, 1]
+            notifier()
+            await func(2)
+            assert calls == [1, 2, 1, 2]
+
+        asyncio.run(run())
+
+
+class TestCsvStream:
+    def test_chunks(self):
+        text = 'name,price\n"multi\nline, ""quoted""",1.5\nплюш,2\r\nlast,3'.encode()
+
+        async def chunks(size):
+            for i in range(0, len(text), size):
+                yield text[i : i + size]
+
+        async def read(size):
+            return [row async for row in iter_csv_rows(chunks(size))]
+
+        expected = [['name', 'price'], ['multi\nline, "quoted"', '1.5'], ['плюш', '2'], ['last', '3']]
+        for size in (1, 2, 7, len(text)):
+            assert asyncio.run(read(size)) == expected
+
+
+class TestBroadcastFunc:
+    def test_publish_receive(self):
+        calls = []
+        published = []
+        func = BroadcastFunc('test_broadcast', [lambda *args, **kwargs: calls.append((args, kwargs))])
+        func(1, key='a')
+        BroadcastFunc.publisher = lambda *args: published.append(args)
+        try:
+            func(2)
+            BroadcastFunc.receive('test_broadcast', [3], {})
+            BroadcastFunc.receive('unknown', [4], {})
+        finally:
+            BroadcastFunc.publisher = None
+        assert calls == [((1,), {'key': 'a'}), ((2,), {}), ((3,), {})]
+        assert published == [('test_broadcast', (2,), {})]
+
+
+class TestCounterAggregator:
+    def test_flush(self):
+        sent = []
+
+        async def send(counts):
+            sent.append(dict(counts))
+
+        async def run():
+            counter = CounterAggregator(send, interval=0.05, max_pending=5)
+            for _ in range(3):
+                counter.add('a')
+            counter.add('b', 10)
+            counter.add(None)
+            await counter._timer
+            for _ in range(5):
+                counter.add('a')
+            await counter._flush
+            counter.add('c')
+            await counter.close()
+            return counter.stats()
+
+        stats = asyncio.run(run())
+        assert sent == [{'a': 3, 'b': 10}, {'a': 5}, {'c': 1}]
+        assert stats['sent'] == stats['added'] == 10
+        assert stats['pending'] == 0
+
+    def test_retry(self):
+        sent = []
+
+        async def send(counts):
+            if not sent:
+                sent.append(None)
+                raise ConnectionError()
+            sent.append(dict(counts))
+
+        async def run():
+            counter = CounterAggregator(send, interval=0.05)
+            counter.add('a')
+            await counter._timer
+            counter.add('a')
+            await counter._timer
+            return counter.stats()
+
+        stats = asyncio.run(run())
+        assert sent == [None, {'a': 2}]
+        assert stats['errors'] == 1
+
+    def test_single_flush(self):
+        sent = []
+
+        async def run():
+            release = asyncio.Event()
+
+            async def send(counts):
+                await release.wait()
+                sent.append(dict(counts))
+
+            counter = CounterAggregator(send, interval=10, max_pending=2)
+            counter.add('a')
+            counter.add('a')
+            flush = counter._flush
+            await asyncio.sleep(0)
+            for _ in range(10):
+                counter.add('a')
+            assert counter._flush is flush
+            release.set()
+            await counter.close()
+
+        asyncio.run(run())
+        assert sent == [{'a': 2}, {'a': 10}]
+
+
+class TestMainLogger:
+    def test_json_lines(self):
+        main_logger = MainLogger('test_logger', max_bytes=300, backup_count=1, json_lines=True)
+        logger = main_logger.init_logger()
+        try:
+            logger.info('item %s', 1, extra={'item_id': 1})
+            try:
+                raise ValueError('broken')
+            except ValueError:
+                logging.getLogger('test_logger.child').exception('failed')
+            MainLogger.stop_listeners()
+            with open(main_logger.log_path) as f:
+                records = [json.loads(line) for line in f]
+            with open(main_logger.log_path + '.1') as f:
+                records = [json.loads(line) for line in f] + records
+            assert records[0]['message'] == 'item 1'
+            assert records[0]['item_id'] == 1
+            assert records[1]['logger'] == 'test_logger.child'
+            assert 'ValueError: broken' in records[1]['exception']
+            assert not logger.handlers
+            assert MainLogger('test_logger', per_process=True).log_path.endswith(f'log_test_logger_{os.getpid()}.log')
+        finally:
+            MainLogger.stop_listeners()
+            for path in (main_logger.log_path, main_logger.log_path + '.1'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+class TestTokenVerifier:
+    def test_cache(self):
+        verifier = TokenVerifier('secret', max_n=2)
+        token = verifier.encode({'sub': 'user', 'exp': time.time() + 60})
+        assert verifier.verify(token)['sub'] == 'user'
+        with mock.patch('jwt.decode') as decode:
+            assert verifier.verify(token)['sub'] == 'user'
+        decode.assert_not_called()
+        assert verifier.stats()['hits'] == 1
+        with pytest.raises(jwt.InvalidTokenError):
+            verifier.verify(TokenVerifier('other').encode({'exp': time.time() + 60}))
+        with pytest.raises(jwt.InvalidTokenError):
+            verifier.verify(verifier.encode({'sub': 'user'}))
+
+    def test_expired(self):
+        verifier = TokenVerifier('secret')
+        exp = int(time.time()) + 2
+        token = verifier.encode({'sub': 'user', 'exp': exp + 0.9})
+        verifier.verify(token)
+        expire_at = verifier.data._data[verifier.get_key(token)][1]
+        assert expire_at - time.monotonic() < exp - time.time() + 0.1  # not until the fractional exp
+        time.sleep(exp - time.time() + 0.05)
+        with pytest.raises(jwt.ExpiredSignatureError):
+            verifier.verify(token)
@@ -1,15 +1,32 @@
 from typing import Dict
-from fastapi import Response
+from os import remove
+from os.path import join, exists
+from fastapi import FastAPI, Response
+from fastapi.testclient import TestClient
+from unittest import mock
+import asyncio
 import json
+import psycopg2
+from peewee import DatabaseError
 
 from backend.library.security import get_password_hash
 from backend.library.tests.utils import faker
+from backend.db import base
+from backend.models.item import ItemCache, ItemInDB, reset_item_cache
+from backend.api.mainapp import items_cache
+from backend.api.metrics import MetricsMiddleware
+from backend.config import METRICS_PROFILE_DIR
+from backend.db.pool import QueryStatsMixin
+from backend.db.query_stats import query_stats, get_fingerprint, is_explainable
+from backend.library.metrics import RequestMetrics, timed
 from tests.base import TestCase
 
 
 class TestCaseApp(TestCase):
     def setUp(self):
         super().setUp()
+        items_cache.data.clear()
+        ItemCache.clear()
         self.sample_one = {
             'name': 'product',
             'price': 10.2,
@@ -24,7 +41,7 @@ class TestCaseApp(TestCase):
         assert rdata["username"] == data["username"]
         assert rdata["email"] == data["email"]
         assert rdata["role"] == data["role"]
-        assert rdata["hashed_password"] == data["hashed_password"]
+        assert "hashed_password" not in rdata
 
     def assert_item(self, response: Response, item_id: int, params: dict = None):
         assert response.status_code == 200
@@ -115,3 +132,346 @@ class TestCaseApp(TestCase):
         assert response.status_code == 200
 
         self.tearDown()
+
+    def test_items_list(self):
+        self.setUp()
+
+        item_ids = [self.assert_item_new(self.sample_one)[0] for _ in range(3)]
+
+        response = self.get("api/items/list", params={'limit': 2})
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert [item['id'] for item in data['items']] == item_ids[:2]
+        assert data['next_after_id'] == item_ids[1]
+
+        response = self.get("api/items/list", params={'limit': 2, 'after_id': data['next_after_id']})
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert [item['id'] for item in data['items']] == item_ids[2:]
+        assert data['next_after_id'] is None
+
+        response = self.get("api/items/list", params={'stream': True})
+        assert response.status_code == 200
+        assert response.headers['content-type'] == 'application/x-ndjson'
+        items = [json.loads(line) for line in response.text.splitlines()]
+        assert [item['id'] for item in items] == item_ids
+        assert items[0]['name'] == self.sample_one['name']
+
+        self.tearDown()
+
+    def test_items_bulk(self):
+        self.setUp()
+
+        item_id = self.assert_item_new(self.sample_one)[0]
+        items = [
+            {'name': 'first', 'price': 1.5},
+            {'name': 'second', 'status': 'vip', 'is_offer': True},
+            {'price': 2.0},
+            {'name': 'third', 'status': 'unknown'},
+            {'id': item_id, 'name': 'updated', 'price': 3.5},
+            {'id': 10**9, 'name': 'missing'},
+        ]
+        response = self.post("/api/items/bulk", json=items)
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert data['success'] is True
+        assert len(data['ids']) == 3 and data['ids'][-1] == item_id
+        assert [error['index'] for error in data['errors']] == [2, 3, 5]
+
+        item = json.loads(self.get(f"/api/items/{data['ids'][1]}").content)
+        assert (item['name'], item['status'], item['is_offer']) == ('second', 'vip', True)
+        item = json.loads(self.get(f"/api/items/{item_id}").content)
+        assert (item['name'], item['price'], item['status']) == ('updated', 3.5, self.sample_one['status'])
+
+        body = '\n'.join(json.dumps({'name': f'line {i}'}) for i in range(5))
+        response = self.post("/api/items/bulk", content=body, headers={'Content-Type': 'application/x-ndjson'})
+        assert response.status_code == 200
+        assert len(json.loads(response.content)['ids']) == 5
+
+        response = self.post("/api/items/bulk", json={'name': 'not a list'})
+        assert response.status_code == 400
+
+        items = [{'id': item_id, 'price': 4.5}, {'id': item_id, 'price': 5.5}]
+        data = json.loads(self.post("/api/items/bulk", json=items).content)
+        assert data['ids'] == [item_id]
+        assert [error['index'] for error in data['errors']] == [1]
+
+        with mock.patch('backend.db.base.execute_atomic', side_effect=DatabaseError('broken')):
+            response = self.post("/api/items/bulk", json=[{'name': 'not written'}])
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert (data['success'], data['ids'], data['error']) == (False, [], 'broken')
+
+        # the row is deleted by another request after it's selected, it's not inserted again
+        async def delete_before(queries, execute_atomic=base.execute_atomic):
+            await base.execute(ItemInDB.delete().where(ItemInDB.id == item_id))
+            return await execute_atomic(queries)
+
+        with mock.patch('backend.db.base.execute_atomic', side_effect=delete_before):
+            data = json.loads(self.post("/api/items/bulk", json=[{'id': item_id, 'name': 'deleted'}]).content)
+        assert (data['success'], data['ids'], data['errors']) == (
+            True,
+            [],
+            [{'index': 0, 'error': f'Object with id {item_id} is not found'}],
+        )
+        assert not asyncio.run(base.execute(ItemInDB.select().where(ItemInDB.id == item_id)))
+
+        self.tearDown()
+
+    def test_items_upload(self):
+        self.setUp()
+
+        rows = [
+            'name,price,status,is_offer',
+            '"first, with comma",1.5,vip,true',
+            '"second\nline",,,no',
+            'third,2,unknown,1',
+            ',3,new,1',
+            'fourth,not a price,new,1',
+            'fifth,4,new,maybe',
+        ]
+        response = self.post("/api/items/upload", content='\r\n'.join(rows), headers={'Content-Type': 'text/csv'})
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert data['success'] is True
+        assert data['rows'] == 2
+        assert [error['row'] for error in data['errors']] == [4, 5, 6, 7]
+        assert data['errors_n'] == 4
+
+        items = json.loads(self.get("/api/items/list").content)['items']
+        assert [(item['name'], item['price'], item['status'], item['is_offer']) for item in items] == [
+            ('first, with comma', 1.5, 'vip', True),
+            ('second\nline', None, 'new', False),
+        ]
+
+        assert all(item['created'] for item in items)
+
+        with mock.patch('backend.db.base.copy_rows', side_effect=psycopg2.Error('broken')):
+            response = self.post("/api/items/upload", content='name\nsixth', headers={'Content-Type': 'text/csv'})
+        data = json.loads(response.content)
+        assert (data['success'], data['rows'], data['error']) == (False, 0, 'broken')
+
+        response = self.post("/api/items/upload", files={'file': ('items.csv', 'name\nfifth\n', 'text/csv')})
+        assert response.status_code == 200
+        assert json.loads(response.content)['rows'] == 1
+
+        response = self.post("/api/items/upload", content='name,unknown\na,b', headers={'Content-Type': 'text/csv'})
+        assert response.status_code == 400
+
+        self.tearDown()
+
+    def test_item_cache(self):
+        self.setUp()
+
+        items = [
+            {'name': 'a', 'price': 1.0, 'status': 'new'},
+            {'name': 'b', 'price': 2.0, 'status': 'vip', 'is_offer': True},
+            {'name': 'c', 'price': 3.0, 'status': 'vip'},
+            {'name': 'd', 'status': 'old'},
+        ]
+        ids = json.loads(self.post("/api/items/bulk", json=items).content)['ids']
+        assert len(asyncio.run(ItemCache.update(full=True))) == 4
+
+        assert list(ItemCache.filter(status='vip')) == ids[1:3]
+        assert list(ItemCache.filter(status='vip', is_offer=False)) == ids[2:3]
+        assert list(ItemCache.filter(price__gte=2.0)) == ids[1:3]
+        assert list(ItemCache.filter(price__gt=1.0, price__lt=3.0)) == ids[1:2]
+        assert list(ItemCache.filter(price__lte=2.0, name='a')) == ids[:1]
+        assert list(ItemCache.filter(price=None)) == ids[3:]
+        assert ItemCache.filter(status='unknown') == {}
+
+        new_ids = json.loads(self.post("/api/items/bulk", json=[{'name': 'e', 'price': 0.5}]).content)['ids']
+        self.post("/api/items/bulk", json=[{'id': ids[2], 'status': 'old'}])
+        assert list(ItemCache.filter(status='vip')) == ids[1:2]
+        asyncio.run(ItemCache.update())
+        assert list(ItemCache.filter(price__lt=2.0)) == ids[:1] + new_ids
+        assert list(ItemCache.filter(price__gte=3.0, status='old')) == ids[2:3]
+
+        # invalidation from other worker
+        reset_item_cache.receive('reset_item_cache', [ids[0]], {})
+        assert ids[0] not in ItemCache.data_obj
+        asyncio.run(ItemCache.update())
+        assert list(ItemCache.filter(status='new')) == [ids[0]] + new_ids
+
+        # ids that are not loaded yet are not kept
+        ItemCache.invalidate(new_ids[0] + 1)
+        ItemCache.clear()
+        ItemCache.invalidate(*ids)
+        assert not ItemCache._stale
+
+        self.tearDown()
+
+    def test_response_cache(self):
+        self.setUp()
+
+        item_id = self.assert_item_new(self.sample_one)[0]
+        response = self.get(f"/api/items/{item_id}")
+        etag = response.headers['etag']
+        self.assert_item(response, item_id)
+        hits = items_cache.data.hits
+        response = self.get(f"/api/items/{item_id}")
+        assert items_cache.data.hits == hits + 1
+        assert response.headers['etag'] == etag
+        response = self.get(f"/api/items/{item_id}", headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        for if_none_match in [f'"other", W/{etag}', '*']:
+            response = self.get(f"/api/items/{item_id}", headers={'If-None-Match': if_none_match})
+            assert response.status_code == 304
+        response = self.get(f"/api/items/{item_id}", headers={'If-None-Match': etag[:-2] + '"'})
+        assert response.status_code == 200
+
+        response = self.get("/api/items/list")
+        assert len(json.loads(response.content)['items']) == 1
+        self.put(f"/api/items/{item_id}", params={'name': 'changed'})
+        response = self.get(f"/api/items/{item_id}", headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['etag'] != etag
+        assert json.loads(response.content)['name'] == 'changed'
+
+        self.assert_item_new(self.sample_one)
+        response = self.get("/api/items/list")
+        assert len(json.loads(response.content)['items']) == 2
+        response = self.get("/api/items/list", params={'stream': True})
+        assert 'etag' not in response.headers
+        assert len(response.text.splitlines()) == 2
+
+        # ids of loaded rows are unknown, so all responses are deleted
+        self.get(f"/api/items/{item_id}")
+        self.post("/api/items/upload", content='name\nthird', headers={'Content-Type': 'text/csv'})
+        assert not items_cache.data
+
+        self.tearDown()
+
+    def test_current_user_cache(self):
+        self.setUp()
+        username = faker.user_name()
+        psw = faker.password()
+        admin = {
+            'username': username,
+            'hashed_password': get_password_hash(psw),
+            'email': faker.email(),
+            'role': ','.join(['admin', 'user']),
+            'disabled': False,
+        }
+        self.user = self.create_user(admin)
+        self.set_token(self.login(username, psw))
+        self.assert_user(admin, self.get("/api/user"))
+
+        admin['email'] = faker.email()
+        self.assert_user(admin, self.signup(**admin))
+        self.assert_user(admin, self.get("/api/user"))
+
+        self.tearDown()
+
+    def test_admin_stats(self):
+        self.setUp()
+        response = self.get("/api/admin/stats")
+        assert response.status_code == 403
+
+        username = faker.user_name()
+        psw = faker.password()
+        self.user = self.create_user(
+            {
+                'username': username,
+                'hashed_password': get_password_hash(psw),
+                'role': 'admin',
+                'disabled': False,
+            }
+        )
+        self.set_token(self.login(username, psw))
+        response = self.get("/api/admin/stats")
+        assert response.status_code == 200
+        data = json.loads(response.content)
+        assert 'db_pool' in data
+        assert data['password_hash']['completed'] > 0
+
+        self.tearDown()
+
+    def test_admin_queries(self):
+        self.setUp()
+        username = faker.user_name()
+        psw = faker.password()
+        self.create_user({'username': username, 'hashed_password': get_password_hash(psw), 'role': 'admin'})
+        self.set_token(self.login(username, psw))
+        enabled, slow_seconds, explain = query_stats.enabled, query_stats.slow_seconds, query_stats.explain
+        query_stats.enabled, query_stats.slow_seconds, query_stats.explain = True, 0, True
+        try:
+            query_stats.clear()
+            self.assert_item_new(self.sample_one)
+            self.get("/api/items/list")
+            QueryStatsMixin.explain_executor.submit(lambda: None).result()  # plans are captured in its only thread
+            response = self.get("/api/admin/queries", params={'order_by': 'count'})
+            assert response.status_code == 200
+            queries = {query['fingerprint']: query for query in json.loads(response.content)['queries']}
+            selects = [query for key, query in queries.items() if key.startswith('SELECT') and '"items"' in key]
+            assert selects and all(query['count'] >= 1 and query['p95'] > 0 for query in selects)
+            assert any(query['plan'] and query['plan']['plan'] for query in selects)
+            assert not any(fingerprint.startswith('EXPLAIN') for fingerprint in queries)
+            response = self.delete("/api/admin/queries")
+            assert response.status_code == 200
+        finally:
+            query_stats.enabled, query_stats.slow_seconds, query_stats.explain = enabled, slow_seconds, explain
+
+        assert get_fingerprint("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'a''b'") == (
+            'SELECT * FROM t WHERE id IN (...) AND name = ?'
+        )
+        assert get_fingerprint('INSERT INTO "t" ("a", "b") VALUES (%s, %s), (%s, %s)') == (
+            'INSERT INTO "t" ("a", "b") VALUES (...)'
+        )
+        assert is_explainable('SELECT * FROM t WHERE name = ?')
+        for sql in [
+            'SELECT * FROM t WHERE id = ? FOR UPDATE',
+            'select * from t for no key update skip locked',
+            'SELECT * FROM t FOR SHARE',
+            'SELECT * INTO t2 FROM t',
+            "SELECT nextval('t_id_seq')",
+            'SELECT pg_advisory_lock(?)',
+            'UPDATE t SET a = ?',
+        ]:
+            assert not is_explainable(sql)
+
+        self.tearDown()
+
+    def test_metrics(self):
+        self.setUp()
+
+        self.assert_item_new(self.sample_one)
+        self.get("/api/items/list")
+        response = self.client.get("/metrics")
+        assert response.status_code == 200
+        lines = response.text.splitlines()
+        assert any(
+            line.startswith('http_request_duration_seconds_count{method="GET",route="/api/items/list"}')
+            for line in lines
+        )
+        assert any('route="/api/items/list",component="db"' in line for line in lines)
+        assert any('route="/login",component="password_hash"' in line for line in lines)
+        assert any(
+            line.startswith('http_responses_total{method="POST",route="/api/items/new",status="200"}') for line in lines
+        )
+
+        self.tearDown()
+
+    def test_profile(self):
+        @timed('db')
+        async def query():
+            await asyncio.sleep(0.01)
+
+        profiled_app = FastAPI()
+
+        @profiled_app.get("/slow/{n}")
+        async def slow(n: int):
+            await query()
+            return {'n': n}
+
+        metrics = RequestMetrics()
+        profiled_app.add_middleware(MetricsMiddleware, metrics=metrics, profile=True, profiler='cprofile')
+        client = TestClient(profiled_app)
+        response = client.get("/slow/1")
+        assert 'x-profile-file' not in response.headers
+        response = client.get("/slow/2", headers={'X-Profile': '1'})
+        path = join(METRICS_PROFILE_DIR, response.headers['x-profile-file'])
+        assert exists(path)
+        remove(path)
+        assert metrics.durations[('GET', '/slow/{n}')].count == 2
+        assert metrics.components[('GET', '/slow/{n}', 'db')].sum >= 0.02